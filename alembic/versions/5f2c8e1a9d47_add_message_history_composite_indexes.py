@@ -0,0 +1,34 @@
+"""Add composite indexes on message_history
+
+Revision ID: 5f2c8e1a9d47
+Revises: 3cd2ad219ddb
+Create Date: 2026-10-15 09:12:40.118204
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+revision: str = '5f2c8e1a9d47'
+down_revision: Union[str, None] = '3cd2ad219ddb'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index(
+        'ix_mh_client_role_ts',
+        'message_history',
+        ['client_id', 'role', sa.text('timestamp DESC')]
+    )
+    op.create_index('ix_mh_client_role_id', 'message_history', ['client_id', 'role', 'id'])
+
+    # client_id is the leading column of both composites, so the single-column index is redundant
+    op.execute('DROP INDEX IF EXISTS ix_message_history_client_id')
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.create_index('ix_message_history_client_id', 'message_history', ['client_id'])
+    op.drop_index('ix_mh_client_role_id', table_name='message_history')
+    op.drop_index('ix_mh_client_role_ts', table_name='message_history')
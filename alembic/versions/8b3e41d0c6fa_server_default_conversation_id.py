@@ -0,0 +1,35 @@
+"""Generate client_contexts.conversation_id in the database
+
+Revision ID: 8b3e41d0c6fa
+Revises: 5f2c8e1a9d47
+Create Date: 2026-10-15 10:02:51.530917
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+revision: str = '8b3e41d0c6fa'
+down_revision: Union[str, None] = '5f2c8e1a9d47'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # gen_random_uuid() is built in from PostgreSQL 13; existing timestamp-style ids are kept as-is
+    op.alter_column(
+        'client_contexts',
+        'conversation_id',
+        existing_type=sa.String(),
+        server_default=sa.text('gen_random_uuid()::text')
+    )
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.alter_column(
+        'client_contexts',
+        'conversation_id',
+        existing_type=sa.String(),
+        server_default=None
+    )
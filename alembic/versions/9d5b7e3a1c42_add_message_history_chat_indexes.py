@@ -0,0 +1,31 @@
+"""Add chat-only and unfiltered (client_id, timestamp) indexes on message_history
+
+Revision ID: 9d5b7e3a1c42
+Revises: e4a9c2f17b05
+Create Date: 2026-10-15 16:05:31.274860
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+revision: str = '9d5b7e3a1c42'
+down_revision: Union[str, None] = 'e4a9c2f17b05'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index(
+        'ix_mh_client_chat_ts',
+        'message_history',
+        ['client_id', sa.text('timestamp DESC')],
+        postgresql_where=sa.text("role IN ('user', 'assistant')")
+    )
+    op.create_index('ix_mh_client_ts', 'message_history', ['client_id', 'timestamp'])
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_mh_client_ts', table_name='message_history')
+    op.drop_index('ix_mh_client_chat_ts', table_name='message_history')
@@ -0,0 +1,31 @@
+"""Drop the (client_id, role, ...) indexes on message_history
+
+Revision ID: b2f7d91e4c30
+Revises: 9d5b7e3a1c42
+Create Date: 2026-10-15 18:22:09.604417
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+revision: str = 'b2f7d91e4c30'
+down_revision: Union[str, None] = '9d5b7e3a1c42'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Chat-window queries use ix_mh_client_chat_ts, everything else ix_mh_client_ts
+    op.drop_index('ix_mh_client_role_id', table_name='message_history')
+    op.drop_index('ix_mh_client_role_ts', table_name='message_history')
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.create_index(
+        'ix_mh_client_role_ts',
+        'message_history',
+        ['client_id', 'role', sa.text('timestamp DESC')]
+    )
+    op.create_index('ix_mh_client_role_id', 'message_history', ['client_id', 'role', 'id'])
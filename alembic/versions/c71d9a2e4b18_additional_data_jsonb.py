@@ -0,0 +1,42 @@
+"""Store client_contexts.additional_data as JSONB
+
+Revision ID: c71d9a2e4b18
+Revises: 8b3e41d0c6fa
+Create Date: 2026-10-15 11:27:06.804412
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+revision: str = 'c71d9a2e4b18'
+down_revision: Union[str, None] = '8b3e41d0c6fa'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.execute("UPDATE client_contexts SET additional_data = '{}' WHERE additional_data IS NULL")
+    op.alter_column(
+        'client_contexts',
+        'additional_data',
+        existing_type=sa.JSON(),
+        type_=postgresql.JSONB(),
+        postgresql_using='additional_data::jsonb',
+        nullable=False,
+        server_default=sa.text("'{}'::jsonb")
+    )
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.alter_column(
+        'client_contexts',
+        'additional_data',
+        existing_type=postgresql.JSONB(),
+        type_=sa.JSON(),
+        postgresql_using='additional_data::json',
+        nullable=True,
+        server_default=None
+    )
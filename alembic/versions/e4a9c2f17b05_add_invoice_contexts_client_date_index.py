@@ -0,0 +1,24 @@
+"""Add (client_id, date_uploaded) index on invoice_contexts
+
+Revision ID: e4a9c2f17b05
+Revises: c71d9a2e4b18
+Create Date: 2026-10-15 13:48:22.517093
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+revision: str = 'e4a9c2f17b05'
+down_revision: Union[str, None] = 'c71d9a2e4b18'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index('ix_inv_client_date', 'invoice_contexts', ['client_id', 'date_uploaded'])
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_inv_client_date', table_name='invoice_contexts')
@@ -3,6 +3,8 @@
 from models import ClientContext
 
 def build_llm_prompt(client_context: ClientContext, invoice_text: str, prompt_version: str = "v1") -> str:
+    # Fetch client_context with `await context_manager.get_context(..., with_invoices=True)`
+    # so this reads already-loaded rows instead of firing a lazy SELECT.
     uploaded_invoices = [inv.invoice_number for inv in client_context.invoices]
 
     return f"""
@@ -1,92 +1,243 @@
 # context_manager.py
 
-from sqlalchemy.orm import Session
-from models import ClientContext, InvoiceContext, MessageHistory
+from sqlalchemy import select, union_all, delete, update, bindparam
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from models import ClientContext, InvoiceContext, MessageHistory, IS_CHAT_MESSAGE, utcnow
 from schemas.mcp import ModelContext, Memory, MessageItem
-from datetime import datetime
+
+# Hot statements, built once at import and parameterized with bindparam() so every call
+# reuses the same compiled SQL from the engine's statement cache.
+_CONTEXT_BY_ID_STMT = select(ClientContext).where(ClientContext.client_id == bindparam("client_id"))
+_CONTEXT_WITH_INVOICES_STMT = _CONTEXT_BY_ID_STMT.options(
+    selectinload(ClientContext.invoices).load_only(InvoiceContext.invoice_number)
+)
+_CONTEXT_STATE_STMT = (
+    select(ClientContext.current_step, ClientContext.last_message)
+    .where(ClientContext.client_id == bindparam("client_id"))
+)
+
+def _build_history_stmt():
+    """
+    Latest “summary” row UNION ALL the last :max_history user/assistant messages.
+    Each branch is a subquery so its DESC/LIMIT window is kept; the outer SELECT
+    then orders everything oldest-first.
+    """
+    cols = (MessageHistory.role, MessageHistory.content, MessageHistory.timestamp)
+    latest_summary = (
+        select(*cols)
+        .where(
+            MessageHistory.client_id == bindparam("client_id"),
+            MessageHistory.role == "summary"
+        )
+        .order_by(MessageHistory.timestamp.desc())
+        .limit(1)
+        .subquery()
+    )
+    recent = (
+        select(*cols)
+        .where(
+            MessageHistory.client_id == bindparam("client_id"),
+            IS_CHAT_MESSAGE
+        )
+        .order_by(MessageHistory.timestamp.desc())
+        .limit(bindparam("max_history"))
+        .subquery()
+    )
+    combined = union_all(select(latest_summary), select(recent)).subquery()
+    return select(combined).order_by(combined.c.timestamp.asc())
+
+_HISTORY_STMT = _build_history_stmt()
+
+def _build_upsert_last_message_stmt():
+    # Column defaults (current_step, created_at/updated_at, additional_data) fill the INSERT side
+    stmt = pg_insert(ClientContext).values(client_id=bindparam("cid"), last_message=bindparam("msg"))
+    return stmt.on_conflict_do_update(
+        index_elements=[ClientContext.client_id],
+        set_={"last_message": stmt.excluded.last_message, "updated_at": stmt.excluded.updated_at}
+    )
+
+_UPSERT_LAST_MESSAGE_STMT = _build_upsert_last_message_stmt()
+
+# Conditional step transition: a no-op (rowcount 0) unless the context is at :from_step.
+# updated_at is filled by the column's onupdate.
+_ADVANCE_STEP_STMT = (
+    update(ClientContext)
+    .where(
+        ClientContext.client_id == bindparam("cid"),
+        ClientContext.current_step == bindparam("from_step")
+    )
+    .values(current_step=bindparam("to_step"), last_message=bindparam("msg"))
+)
+
+_OVER_THRESHOLD_STMT = (
+    select(MessageHistory.id)
+    .where(
+        MessageHistory.client_id == bindparam("client_id"),
+        IS_CHAT_MESSAGE
+    )
+    .offset(bindparam("threshold"))
+    .limit(1)
+)
+
+# Delete user/assistant messages outside the most recent :threshold; the keep-list is a
+# LIMITed subquery so pruning is a single statement
+_PRUNE_STMT = delete(MessageHistory).where(
+    MessageHistory.client_id == bindparam("client_id"),
+    IS_CHAT_MESSAGE,
+    ~MessageHistory.id.in_(
+        select(MessageHistory.id)
+        .where(
+            MessageHistory.client_id == bindparam("client_id"),
+            IS_CHAT_MESSAGE
+        )
+        .order_by(MessageHistory.timestamp.desc())
+        .limit(bindparam("threshold"))
+    )
+)
+
+async def _commit_or_flush(db: AsyncSession, commit: bool):
+    """
+    Helpers commit by default; request pipelines pass commit=False and commit once at the end.
+    Flushing still assigns PKs/defaults, so no db.refresh() is needed either way.
+    """
+    if commit:
+        await db.commit()
+    else:
+        await db.flush()
 
 # -------------------------------------------------------------------------------------------------
 # 1) get_or_create_context
 # -------------------------------------------------------------------------------------------------
-def get_or_create_context(db: Session, client_id: str) -> ClientContext:
-    context = db.query(ClientContext).filter(ClientContext.client_id == client_id).first()
-    if not context:
-        context = ClientContext(
-            client_id=client_id,
-            conversation_id=str(datetime.utcnow().timestamp()),
+async def get_or_create_context(db: AsyncSession, client_id: str, commit: bool = True) -> ClientContext:
+    context = await db.scalar(_CONTEXT_BY_ID_STMT, {"client_id": client_id})
+    if context:
+        return context
+    # Two first requests for a new client can both get here; ON CONFLICT DO NOTHING lets the
+    # loser reuse the winner's row instead of failing on the unique client_id.
+    # Callers should keep the default commit=True so the row lock isn't held for the request.
+    await db.execute(
+        pg_insert(ClientContext)
+        .values(
+            client_id=client_id,            # conversation_id is generated by the DB
             current_step="awaiting_invoice",   # <--- use current_step
             last_message="",
             additional_data={}
         )
-        db.add(context)
-        db.commit()
-        db.refresh(context)
-    return context
+        .on_conflict_do_nothing(index_elements=[ClientContext.client_id])
+    )
+    await _commit_or_flush(db, commit)
+    return await db.scalar(_CONTEXT_BY_ID_STMT, {"client_id": client_id})
 
 # -------------------------------------------------------------------------------------------------
 # 2) add_invoice
 # -------------------------------------------------------------------------------------------------
-def add_invoice(db: Session, client_id: str, invoice_number: str) -> InvoiceContext:
-    context = get_or_create_context(db, client_id)
+async def add_invoice(db: AsyncSession, client_id: str, invoice_number: str, commit: bool = True, **fields) -> InvoiceContext:
+    context = await get_or_create_context(db, client_id, commit=commit)
     invoice = InvoiceContext(
         invoice_number=invoice_number,
         status="received",
-        date_uploaded=datetime.utcnow(),
-        client_id=client_id
+        date_uploaded=utcnow(),
+        client_id=client_id,
+        **fields
     )
     db.add(invoice)
-    db.commit()
-    db.refresh(invoice)
+    await _commit_or_flush(db, commit)
     return invoice
 
 # -------------------------------------------------------------------------------------------------
 # 3) update_context_step (still uses current_step)
 # -------------------------------------------------------------------------------------------------
-def update_context_step(db: Session, client_id: str, step: str) -> ClientContext:
-    context = get_or_create_context(db, client_id)
-    context.current_step = step    # <--- use current_step
-    db.commit()
-    db.refresh(context)
+async def update_context_step(db: AsyncSession, client_id: str, step: str, commit: bool = True) -> ClientContext:
+    context = await _upsert_context(db, client_id, current_step=step)    # <--- use current_step
+    await _commit_or_flush(db, commit)
     return context
 
+async def advance_context_step(
+    db: AsyncSession, client_id: str, from_step: str, to_step: str, message: str, commit: bool = True
+) -> bool:
+    """
+    Move the context from `from_step` to `to_step` and set last_message, in one UPDATE whose
+    WHERE checks the current step (no read first). Returns whether the step changed.
+    """
+    result = await db.execute(
+        _ADVANCE_STEP_STMT,
+        {"cid": client_id, "from_step": from_step, "to_step": to_step, "msg": message},
+        execution_options={"synchronize_session": False}
+    )
+    await _commit_or_flush(db, commit)
+    return result.rowcount > 0
+
 # -------------------------------------------------------------------------------------------------
 # 4) update_last_message
 # -------------------------------------------------------------------------------------------------
-def update_last_message(db: Session, client_id: str, message: str) -> ClientContext:
-    context = get_or_create_context(db, client_id)
-    context.last_message = message
-    db.commit()
-    db.refresh(context)
-    return context
+async def update_last_message(db: AsyncSession, client_id: str, message: str, commit: bool = True) -> None:
+    """
+    Runs on every turn, so it skips the ORM unit-of-work: one pre-built Core upsert,
+    no entity is loaded or returned.
+    """
+    await db.execute(_UPSERT_LAST_MESSAGE_STMT, {"cid": client_id, "msg": message})
+    await _commit_or_flush(db, commit)
+
+async def _upsert_context(db: AsyncSession, client_id: str, **fields) -> ClientContext:
+    """
+    INSERT ... ON CONFLICT (client_id) DO UPDATE in a single round-trip.
+    Creates the ClientContext with defaults if missing, otherwise only sets `fields`.
+    """
+    now = utcnow()
+    values = {
+        "client_id": client_id,
+        "current_step": "awaiting_invoice",
+        "last_message": "",
+        "additional_data": {},
+        **fields,
+    }
+    stmt = (
+        pg_insert(ClientContext)
+        .values(**values)
+        .on_conflict_do_update(
+            index_elements=[ClientContext.client_id],
+            set_={**fields, "updated_at": now}   # onupdate does not fire for ON CONFLICT
+        )
+        .returning(ClientContext)
+    )
+    result = await db.scalars(stmt, execution_options={"populate_existing": True})
+    return result.one()
 
 # -------------------------------------------------------------------------------------------------
 # 5) get_context
 # -------------------------------------------------------------------------------------------------
-def get_context(db: Session, client_id: str) -> ClientContext:
-    return db.query(ClientContext).filter(ClientContext.client_id == client_id).first()
+async def get_context(db: AsyncSession, client_id: str, with_invoices: bool = False) -> ClientContext:
+    """
+    with_invoices=True eager-loads ClientContext.invoices (invoice_number only) in one
+    extra SELECT ... IN, so build_prompt.build_llm_prompt doesn't lazy-load per context.
+    """
+    stmt = _CONTEXT_WITH_INVOICES_STMT if with_invoices else _CONTEXT_BY_ID_STMT
+    return await db.scalar(stmt, {"client_id": client_id})
 
 # -------------------------------------------------------------------------------------------------
 # 6) log_message
 # -------------------------------------------------------------------------------------------------
-def log_message(db: Session, client_id: str, role: str, content: str) -> MessageHistory:
+async def log_message(db: AsyncSession, client_id: str, role: str, content: str, commit: bool = True) -> MessageHistory:
     """
     Logs a new MessageHistory entry with the given role and content.
+    Pass commit=False to only flush and let the caller commit once per request.
     """
     msg = MessageHistory(
         client_id=client_id,
         role=role,
         content=content,
-        timestamp=datetime.utcnow()
+        timestamp=utcnow()
     )
     db.add(msg)
-    db.commit()
-    db.refresh(msg)
+    await _commit_or_flush(db, commit)
     return msg
 
 # -------------------------------------------------------------------------------------------------
 # 7) build_model_context
 # -------------------------------------------------------------------------------------------------
-def build_model_context(db: Session, client_id: str, max_history: int = 20) -> ModelContext:
+async def build_model_context(db: AsyncSession, client_id: str, max_history: int = 20) -> ModelContext:
     """
     Assemble a ModelContext for MCP.
     - memory.last_summary: latest summary message (if any)
@@ -95,24 +246,25 @@ def build_model_context(db: Session, client_id: str, max_history: int = 20) -> M
     - tool_inputs: None (for now)
     - tools: will be injected by main.py before sending to GPT
     """
-    # A) Fetch the ClientContext
-    client_ctx = db.query(ClientContext).filter(ClientContext.client_id == client_id).first()
+    # A) Fetch only the ClientContext columns we use
+    client_ctx = (await db.execute(_CONTEXT_STATE_STMT, {"client_id": client_id})).first()
     if not client_ctx:
         raise ValueError(f"No ClientContext found for client_id={client_id!r}")
 
-    # B) Get the latest “summary” row (if it exists)
-    last_summary_entry = (
-        db.query(MessageHistory)
-        .filter(
-            MessageHistory.client_id == client_id,
-            MessageHistory.role == "summary"
-        )
-        .order_by(MessageHistory.timestamp.desc())
-        .first()
-    )
-    summary_text = last_summary_entry.content if last_summary_entry else None
+    # B) Latest “summary” row + recent user/assistant messages in one round-trip
+    rows = (
+        await db.execute(_HISTORY_STMT, {"client_id": client_id, "max_history": max_history})
+    ).all()
+
+    # C) Split by role: the summary feeds Memory, the rest become messages (already oldest first)
+    summary_text = None
+    recent_msgs = []
+    for row in rows:
+        if row.role == "summary":
+            summary_text = row.content
+        else:
+            recent_msgs.append(row)
 
-    # C) Build Memory object
     memory = Memory(
         last_summary=summary_text,
         additional_data={
@@ -121,31 +273,13 @@ def build_model_context(db: Session, client_id: str, max_history: int = 20) -> M
         }
     )
 
-    # D) Fetch recent user/assistant messages (excluding “summary”)
-    recent_msgs = (
-        db.query(MessageHistory)
-        .filter(
-            MessageHistory.client_id == client_id,
-            MessageHistory.role.in_(["user", "assistant"])
-        )
-        .order_by(MessageHistory.timestamp.desc())
-        .limit(max_history)
-        .all()
-    )
-    recent_msgs = list(reversed(recent_msgs))  # oldest first
-
-    # E) Convert each to a MessageItem instance
-    msgs = []
-    for m in recent_msgs:
-        msgs.append(
-            MessageItem(
-                role=m.role,
-                content=m.content,
-                timestamp=m.timestamp
-            )
-        )
+    # D) Convert each to a MessageItem instance
+    msgs = [
+        MessageItem(role=role, content=content, timestamp=timestamp)
+        for role, content, timestamp in recent_msgs
+    ]
 
-    # F) Construct ModelContext (tools will be injected later)
+    # E) Construct ModelContext (tools will be injected later)
     model_ctx = ModelContext(
         memory=memory,
         messages=msgs,
@@ -158,49 +292,35 @@ def build_model_context(db: Session, client_id: str, max_history: int = 20) -> M
 # -------------------------------------------------------------------------------------------------
 # 8) auto_summarize_if_needed
 # -------------------------------------------------------------------------------------------------
-def auto_summarize_if_needed(db: Session, client_id: str, threshold: int = 15):
+async def auto_summarize_if_needed(
+    db: AsyncSession, client_id: str, threshold: int = 15, commit: bool = True
+):
     """
     If there are more than `threshold` user/assistant messages for this client,
     automatically call summarization and delete older chat rows.
+    With commit=False nothing is committed, so the caller's log/step writes and the
+    summary + prune land in one transaction.
     """
-    # 8A) Count user/assistant messages (ignore role="summary")
-    count = (
-        db.query(MessageHistory)
-        .filter(
-            MessageHistory.client_id == client_id,
-            MessageHistory.role.in_(["user", "assistant"])
-        )
-        .count()
+    # 8A) Is there a (threshold+1)-th user/assistant message? Stops scanning at that row
+    #     instead of counting the whole history (ignore role="summary")
+    over_threshold = await db.scalar(
+        _OVER_THRESHOLD_STMT, {"client_id": client_id, "threshold": threshold}
     )
-    if count <= threshold:
+    if over_threshold is None:
         return
 
     # 8B) Trigger summarization (reuse the existing summarize_context endpoint logic)
-    from routes.summarize import summarize_context
-    result = summarize_context(client_id, db)  # returns {"summary": ...}
-    summary_text = result.get("summary", "")
-
-    # 8C) Find IDs of the most recent `threshold` messages (desc), then prune others
-    recent_ids = [
-        m.id for m in (
-            db.query(MessageHistory.id)
-            .filter(
-                MessageHistory.client_id == client_id,
-                MessageHistory.role.in_(["user", "assistant"])
-            )
-            .order_by(MessageHistory.timestamp.desc())
-            .limit(threshold)
-            .all()
-        )
-    ]
+    from routes.summarize import summarize_client_context
+    await summarize_client_context(db, client_id, commit=False)
 
-    # Delete any user/assistant messages not in recent_ids
-    db.query(MessageHistory).filter(
-        MessageHistory.client_id == client_id,
-        MessageHistory.role.in_(["user", "assistant"]),
-        ~MessageHistory.id.in_(recent_ids)
-    ).delete(synchronize_session=False)
-    db.commit()
+    # 8C) Delete any user/assistant messages outside the most recent `threshold`,
+    #     selecting the IDs to keep in a subquery so it is a single statement
+    await db.execute(
+        _PRUNE_STMT,
+        {"client_id": client_id, "threshold": threshold},
+        execution_options={"synchronize_session": False}
+    )
+    await _commit_or_flush(db, commit)
 
     # 8D) After summarization, the new MessageHistory row with role="summary"
-    #       has already been inserted by summarize_context(), so no further action needed.
+    #       has already been inserted by summarize_client_context(), so no further action needed.
@@ -1,5 +1,5 @@
 from typing import List, Dict, Optional
-from datetime import datetime
+from datetime import datetime, timezone
 
 class InvoiceContext:
     def __init__(self,
@@ -8,7 +8,7 @@ class InvoiceContext:
                  date_uploaded: Optional[datetime] = None):
         self.invoice_number = invoice_number
         self.status = status
-        self.date_uploaded = date_uploaded or datetime.utcnow()
+        self.date_uploaded = date_uploaded or datetime.now(timezone.utc)
 
     def to_dict(self):
         return {
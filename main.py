@@ -1,15 +1,21 @@
 # main.py
 
-import base64
-import json
+import asyncio
 import logging
-from datetime import datetime
+import os
+import shutil
+import tempfile
+from contextlib import asynccontextmanager
+from typing import Optional
+
+import orjson
 
 from fastapi import FastAPI, File, UploadFile, Request, Depends, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy.orm import Session
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from database import SessionLocal, engine
+from database import engine, get_db
 import models
 import context_manager
 
@@ -20,10 +26,11 @@ from routes.describe import router as describe_router
 
 # Schemas and tool registry
 from schemas.mcp import ModelContext, MessageItem
-from schemas.tools import ToolDefinition
 from tool_registry import tool_registry
+from tools.parse_invoice import warm_ocr_pool
+from tools.xero_utils import xero_http
 
-from openai import OpenAI
+from openai_client import async_client
 from dotenv import load_dotenv
 
 # --- Logging Setup ---
@@ -32,10 +39,40 @@ logger = logging.getLogger(__name__)
 
 # --- Environment and DB ---
 load_dotenv()
-models.Base.metadata.create_all(bind=engine)
+
+async def _warm_up():
+    """
+    Open a DB connection, the OpenAI TLS connection and the OCR workers before the first
+    request, so it doesn't pay for them. Failures are logged, never fatal.
+    """
+    async def ping_db():
+        async with engine.connect() as conn:
+            await conn.execute(text("SELECT 1"))
+
+    async def ping_openai():
+        await async_client.models.list()
+
+    results = await asyncio.gather(
+        ping_db(), ping_openai(), asyncio.to_thread(warm_ocr_pool), return_exceptions=True
+    )
+    for name, result in zip(("database", "openai", "ocr"), results):
+        if isinstance(result, Exception):
+            logger.warning(f"Warm-up of {name} failed: {result!r}")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # The schema is owned by Alembic (entrypoint.sh runs `alembic upgrade head`); create_all is
+    # only for throwaway databases and costs a catalog round-trip per table on every worker boot.
+    if os.getenv("DB_CREATE_ALL"):
+        async with engine.begin() as conn:
+            await conn.run_sync(models.Base.metadata.create_all)
+    await _warm_up()
+    yield
+    await xero_http.aclose()
+    await engine.dispose()
 
 # --- FastAPI App ---
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 # --- Middleware and Routers ---
 app.add_middleware(
@@ -54,31 +91,38 @@ app.include_router(summarize.router)
 app.include_router(categorize.router)
 app.include_router(describe_router)
 
-# --- Dependency ---
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+UPLOAD_CHUNK_SIZE = 64 * 1024
+
+def _spool_upload(upload: UploadFile) -> str:
+    """
+    Copy the upload to a temp file in fixed-size chunks (never holding the whole PDF in memory)
+    and return its path. The caller removes the file.
+    """
+    with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as tmp:
+        upload.file.seek(0)
+        shutil.copyfileobj(upload.file, tmp, UPLOAD_CHUNK_SIZE)
+    return tmp.name
 
 # --- Invoice Processing Endpoint ---
 @app.post("/process-invoice/")
 async def process_invoice(
     file: UploadFile = File(...),
     request: Request = None,
-    db: Session = Depends(get_db)
+    include: Optional[str] = None,
+    db: AsyncSession = Depends(get_db)
 ):
+    """
+    Parses an uploaded invoice PDF. The client's context (step, invoice numbers) is only
+    loaded and returned with ?include=context, since it grows with the client's history.
+    """
     client_id = request.headers.get("X-Client-ID", "default_client")
-    raw_bytes = await file.read()
-    file_b64 = base64.b64encode(raw_bytes).decode()
 
     # Always ensure ClientContext exists (portable across laptops/databases)
-    context = context_manager.get_or_create_context(db, client_id)
+    await context_manager.get_or_create_context(db, client_id)
 
     # 1. Build Model Context (includes memory & tools)
     try:
-        model_ctx: ModelContext = context_manager.build_model_context(db, client_id)
+        model_ctx: ModelContext = await context_manager.build_model_context(db, client_id)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Context build error: {e}")
 
@@ -86,25 +130,21 @@ async def process_invoice(
         MessageItem(
             role="user",
             content="Please parse my invoice PDF with the parse_invoice tool.",
-            timestamp=datetime.utcnow()
+            timestamp=models.utcnow()
         )
     )
 
-    # Register tools (tool_registry)
-    all_tools = [
-        ToolDefinition(
-            name=name,
-            description=info["description"],
-            input_schema=info["input_schema"]
-        ) for name, info in tool_registry.list_tools().items()
-    ]
-    model_ctx.tools = all_tools
-
     # 2. LLM Tool Selection
-    client = OpenAI()
-    system_prompt = {
+    # Static prefix first (instructions + tool list, identical across requests) so OpenAI's
+    # prompt cache can reuse it; the per-client memory/messages follow.
+    serialized_ctx = model_ctx.model_dump_json(exclude={"tools"})
+    tools_prompt = {
+        "role": "system",
+        "content": tool_registry.selection_prompt()
+    }
+    context_prompt = {
         "role": "system",
-        "content": json.dumps(model_ctx.dict(), default=str)
+        "content": serialized_ctx
     }
     user_prompt = {
         "role": "user",
@@ -115,46 +155,71 @@ async def process_invoice(
     }
 
     try:
-        response = client.chat.completions.create(
+        response = await async_client.chat.completions.create(
             model="gpt-4o-mini",
-            messages=[system_prompt, user_prompt],
-            temperature=0
+            response_format={"type": "json_object"},
+            messages=[tools_prompt, context_prompt, user_prompt],
+            temperature=0,
+            max_tokens=20  # the answer is just {"tool": "..."}
         )
         raw = response.choices[0].message.content
         logger.info(f"OpenAI tool select raw: {repr(raw)}")
+        usage_details = getattr(response.usage, "prompt_tokens_details", None)
+        logger.info(f"OpenAI tool select cached prompt tokens: {getattr(usage_details, 'cached_tokens', 0)}")
         if not raw or not raw.strip():
             raise HTTPException(status_code=500, detail="LLM response was empty. (Check OpenAI API or prompt!)")
         try:
-            tool_invocation = json.loads(raw)
+            tool_invocation = orjson.loads(raw)
         except Exception as e:
             logger.error(f"Failed to parse LLM output: {repr(raw)}")
             raise HTTPException(status_code=500, detail=f"Tool selection error: {e}. Raw output: {repr(raw)}")
+    except HTTPException:
+        raise  # already carries a specific message
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Tool selection error: {e}")
 
     if tool_invocation.get("tool") != "parse_invoice":
         raise HTTPException(status_code=400, detail=f"GPT did not choose parse_invoice. Got: {tool_invocation}")
 
-    # 3. Tool Execution
+    # 3. Tool Execution (an already-extracted invoice text is answered from parse_invoice's cache)
+    # The tool runs in-process, so hand it a spooled file instead of a base64 copy of the upload
+    pdf_path = await asyncio.to_thread(_spool_upload, file)
     try:
-        tool_result = tool_registry.call("parse_invoice", {"file_bytes": file_b64})
+        # OCR + LLM extraction is blocking; keep it off the event loop
+        tool_result = await asyncio.to_thread(tool_registry.call, "parse_invoice", {"file_path": pdf_path})
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"parse_invoice tool error: {e}")
+    finally:
+        os.remove(pdf_path)
 
-    # 4. Log, summarize, and update context
-    raw_tool_output = json.dumps(tool_result)
-    context_manager.log_message(db, client_id, "assistant", raw_tool_output)
-    context_manager.auto_summarize_if_needed(db, client_id)
+    # 4. Log, summarize (if due) and update context in a single transaction. The summary's
+    #    LLM call runs before the context UPDATEs so it never holds the client_context row lock.
+    raw_tool_output = orjson.dumps(tool_result).decode()
+    await context_manager.log_message(db, client_id, "assistant", raw_tool_output, commit=False)
+    await context_manager.auto_summarize_if_needed(db, client_id, commit=False)
 
     invoice_number = tool_result.get("invoice_number")
     if invoice_number:
-        inv = context_manager.add_invoice(db, client_id, invoice_number)
-        inv.ocr_text = ""  # OCR is in the tool already
-        inv.prompt_used = json.dumps(model_ctx.dict(), default=str)
-        inv.llm_response_raw = raw_tool_output
-        db.commit()
-
-        context_manager.update_context_step(db, client_id, "invoice_processed")
-        context_manager.update_last_message(db, client_id, f"Parsed invoice {invoice_number}")
-
-    return {"structured_data": tool_result}
+        await context_manager.add_invoice(
+            db, client_id, invoice_number, commit=False,
+            ocr_text="",  # OCR is in the tool already
+            # What the model saw: the context plus the tool list it chose from, spliced from
+            # the strings already built for the prompt (tools is ModelContext's last field)
+            prompt_used=f'{serialized_ctx[:-1]},"tools":{tool_registry.definitions_json()}}}',
+            llm_response_raw=raw_tool_output
+        )
+        await context_manager.update_context_step(db, client_id, "invoice_processed", commit=False)
+        await context_manager.update_last_message(db, client_id, f"Parsed invoice {invoice_number}", commit=False)
+    await db.commit()
+
+    response = {"structured_data": tool_result}
+    if include == "context":
+        # invoice numbers come from one extra SELECT ... IN, not a lazy load per invoice
+        ctx = await context_manager.get_context(db, client_id, with_invoices=True)
+        response["context"] = {
+            "client_id": ctx.client_id,
+            "current_step": ctx.current_step,
+            "last_message": ctx.last_message,
+            "invoices": [inv.invoice_number for inv in ctx.invoices],
+        }
+    return response
@@ -1,21 +1,28 @@
 # models.py
 
-from sqlalchemy import Column, String, Integer, DateTime, JSON, ForeignKey, Text
+from sqlalchemy import Column, String, Integer, DateTime, ForeignKey, Text, Index, literal_column, text
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.orm import declarative_base, relationship
-from datetime import datetime
+from datetime import datetime, timezone
 
 Base = declarative_base()
 
+def utcnow() -> datetime:
+    """Current UTC time, naive: the DateTime columns are `timestamp without time zone`."""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
 class ClientContext(Base):
     __tablename__ = 'client_contexts'
+    # Fetch server-generated columns (conversation_id) via RETURNING at flush, so no refresh is needed
+    __mapper_args__ = {"eager_defaults": True}
 
     client_id = Column(String, primary_key=True, index=True)
-    conversation_id = Column(String, index=True)
+    conversation_id = Column(String, index=True, server_default=text("gen_random_uuid()::text"))
     current_step = Column(String, default="awaiting_invoice")
     last_message = Column(String, nullable=True)
-    additional_data = Column(JSON, default={})
-    created_at = Column(DateTime, default=datetime.utcnow)
-    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    additional_data = Column(JSONB, nullable=False, default=dict, server_default=text("'{}'::jsonb"))
+    created_at = Column(DateTime, default=utcnow)
+    updated_at = Column(DateTime, default=utcnow, onupdate=utcnow)
 
     invoices = relationship("InvoiceContext", back_populates="client_context")
     messages = relationship(
@@ -30,7 +37,7 @@ class InvoiceContext(Base):
     id = Column(Integer, primary_key=True, index=True)
     invoice_number = Column(String, index=True)
     status = Column(String, default="received")
-    date_uploaded = Column(DateTime, default=datetime.utcnow)
+    date_uploaded = Column(DateTime, default=utcnow)
     client_id = Column(String, ForeignKey('client_contexts.client_id'))
 
     # MCP Fields you already have:
@@ -44,9 +51,27 @@ class MessageHistory(Base):
     __tablename__ = "message_history"
 
     id = Column(Integer, primary_key=True, index=True)
-    client_id = Column(String, ForeignKey('client_contexts.client_id'), index=True)
+    client_id = Column(String, ForeignKey('client_contexts.client_id'))
     role = Column(String)      # 'user' / 'assistant' / 'summary'
     content = Column(Text)
-    timestamp = Column(DateTime, default=datetime.utcnow)
+    timestamp = Column(DateTime, default=utcnow)
 
     client_context = relationship("ClientContext", back_populates="messages")
+
+# Chat turns (not summaries). The filter renders the roles as SQL literals rather than bind
+# params so the planner can prove it matches the partial index's predicate.
+CHAT_ROLES = ("user", "assistant")
+IS_CHAT_MESSAGE = MessageHistory.role.in_([literal_column(f"'{role}'") for role in CHAT_ROLES])
+Index(
+    "ix_mh_client_chat_ts",
+    MessageHistory.client_id, MessageHistory.timestamp.desc(),
+    postgresql_where=MessageHistory.role.in_(CHAT_ROLES)
+)
+# Unfiltered per-client history (routes/message_history.py), either direction, and the
+# latest-summary lookup: pruning keeps few chat rows, so the backward scan to it is short.
+# client_id leads both indexes, so there is no single-column client_id index.
+Index("ix_mh_client_ts", MessageHistory.client_id, MessageHistory.timestamp)
+
+# ClientContext.invoices loads by client_id (no index on the FK otherwise); date_uploaded
+# second serves per-client "latest invoices" ordering from the same index.
+Index("ix_inv_client_date", InvoiceContext.client_id, InvoiceContext.date_uploaded)
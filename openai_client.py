@@ -0,0 +1,27 @@
+# openai_client.py
+
+import httpx
+from dotenv import load_dotenv
+from openai import AsyncOpenAI, OpenAI
+
+load_dotenv()
+
+# One client per process: its httpx pool keeps TLS/HTTP2 connections to the API warm across
+# requests instead of re-handshaking every time. Import it; don't construct clients per call.
+async_client = AsyncOpenAI(
+    http_client=httpx.AsyncClient(
+        http2=True,
+        limits=httpx.Limits(max_keepalive_connections=50, max_connections=100),
+        timeout=httpx.Timeout(60.0, connect=5.0),
+    )
+)
+
+# The same for the blocking tools (parse_invoice, describe_invoice, summarization), which run
+# in worker threads: one shared, thread-safe connection pool instead of one per module.
+client = OpenAI(
+    http_client=httpx.Client(
+        http2=True,
+        limits=httpx.Limits(max_keepalive_connections=50, max_connections=100),
+        timeout=httpx.Timeout(60.0, connect=5.0),
+    )
+)
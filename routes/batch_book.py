@@ -1,41 +1,57 @@
 # routes/batch_book.py
 
+import asyncio
+import httpx
 from fastapi import APIRouter, Body
 from typing import List
-from tools.book_payable_invoice import book_payable_invoice_tool
-from tools.categorize_expense import categorize_expense_tool_async  # Make sure this is async!
+from tools.book_payable_invoice import book_payable_invoices_bulk
+from tools.categorize_expense import categorize_expenses_batch
+from tools.xero_accounts import get_all_expense_accounts, normalize
+from tools.xero_utils import XeroToolError
 
 router = APIRouter()
 
+async def _categorize_missing(payload: List[dict]) -> None:
+    """
+    Fill in every missing line-item category across the whole batch with a single
+    categorize_expenses_batch call (one thread hop), instead of one call per invoice.
+    Line items are matched against the org's expense accounts, narrowed to an invoice's
+    allowed_categories when it has them.
+    """
+    pending = []  # tool inputs for each invoice with uncategorized line items
+    accounts = None
+    for inv in payload:
+        missing = [li for li in inv.get("line_items", []) if not li.get("category")]
+        if missing:
+            if accounts is None:
+                accounts = await get_all_expense_accounts()  # fetched once per batch
+            allowed_accounts = accounts
+            if inv.get("allowed_categories") is not None:
+                allowed = {normalize(c) for c in inv["allowed_categories"]}
+                allowed_accounts = [acc for acc in accounts if normalize(acc["name"]) in allowed]
+            pending.append({"line_items": missing, "allowed_accounts": allowed_accounts})
+    if not pending:
+        return
+
+    cat_results = await asyncio.to_thread(categorize_expenses_batch, pending)
+    # Results come back in input order; scatter them onto the original line items
+    for cat_input, cat_result in zip(pending, cat_results):
+        categories = cat_result.get("categories", [])
+        for i, li in enumerate(cat_input["line_items"]):
+            li["category"] = (categories[i].get("category") if i < len(categories) else None) or "generalexpenses"
+
 @router.post("/batch/book-invoices/")
 async def batch_book_invoices(payload: List[dict] = Body(...)):
     """
     Accepts a list of invoice dicts, each may contain 'pdf_bytes'.
-    For each, AI-categorizes line items (if missing), then books to Xero (with PDF attachment).
+    AI-categorizes all missing line items in one pass, then books the invoices to Xero in
+    bulk Invoices POSTs (PDF attachments follow, at most 5 at a time).
     """
-    results = []
-    for inv in payload:
-        # AI categorize if any line item is missing a category
-        needs_category = any(not li.get("category") for li in inv.get("line_items", []))
-        if needs_category:
-            # Forward allowed_categories if present, else all
-            allowed_categories = inv.get("allowed_categories")
-            cat_input = {
-                "invoice_number": inv.get("invoice_number"),
-                "supplier": inv.get("supplier"),
-                "line_items": inv.get("line_items", [])
-            }
-            if allowed_categories is not None:
-                cat_input["allowed_categories"] = allowed_categories
-            cat_result = await categorize_expense_tool_async(cat_input)
-            desc2cat = {x["description"]: x["category"] for x in cat_result.get("categories", [])}
-            for li in inv["line_items"]:
-                if not li.get("category"):
-                    li["category"] = desc2cat.get(li["description"], "generalexpenses")
-        # Book invoice (with PDF bytes if present)
-        try:
-            res = await book_payable_invoice_tool(inv)
-            results.append(res)
-        except Exception as e:
-            results.append({"error": str(e)})
-    return results
+    # Per-invoice failures come back as {"error": ...} entries from the bulk helper; only
+    # errors that sink the whole batch (no or expired Xero auth, missing credentials,
+    # Xero unreachable) are caught here, and reported against every invoice.
+    try:
+        await _categorize_missing(payload)
+        return await book_payable_invoices_bulk(payload)  # results stay in payload order
+    except (XeroToolError, httpx.HTTPError) as e:
+        return [{"error": str(e)} for _ in payload]
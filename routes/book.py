@@ -1,6 +1,6 @@
 from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
-from database import SessionLocal
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import get_db
 from schemas.tools import ToolInvocation, ToolResult
 from tools.book_payable_invoice import book_payable_invoice_tool  # NEW: this is now async!
 from tools.categorize_expense import categorize_expense_tool_async
@@ -8,15 +8,8 @@ from tools.xero_accounts import get_all_expense_accounts
 
 router = APIRouter(tags=["booking"])
 
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
 @router.post("/book-invoice/", response_model=ToolResult)
-async def book_invoice(payload: ToolInvocation, db: Session = Depends(get_db)):
+async def book_invoice(payload: ToolInvocation, db: AsyncSession = Depends(get_db)):
     # 1. Run categorization if not already categorized
     line_items = payload.line_items
     if not all("category" in li for li in line_items):
@@ -32,7 +25,7 @@ async def book_invoice(payload: ToolInvocation, db: Session = Depends(get_db)):
 
     # 2. Book invoice (now uses dynamic account code per category)
     try:
-        result = await book_payable_invoice_tool(payload.dict())
+        result = await book_payable_invoice_tool(payload.model_dump())
     except KeyError as e:
         raise HTTPException(status_code=500, detail=f"Tool error: {e}")
     return result
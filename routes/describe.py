@@ -1,10 +1,10 @@
 # routes/describe.py
 
 from fastapi import APIRouter, Body
-from tools.describe_invoice import describe_invoice_tool
+from tools.describe_invoice import describe_invoice_tool_async
 
 router = APIRouter(tags=["Describe"])
 
 @router.post("/describe-invoice/")
 async def describe_invoice(payload: dict = Body(...)):
-    return describe_invoice_tool(payload)
+    return await describe_invoice_tool_async(payload)
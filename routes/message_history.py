@@ -1,15 +1,27 @@
 # routes/message_history.py
 
 from fastapi import APIRouter, Depends, Query, HTTPException
-from sqlalchemy.orm import Session
-from database import SessionLocal
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import SessionLocal, get_db
 from models import MessageHistory
 from typing import List, Optional
 from datetime import datetime
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict
+import orjson
 
 router = APIRouter(prefix="/message-history", tags=["Message History"])
 
+HISTORY_CHUNK = 200  # rows fetched and encoded per round-trip when streaming a full history
+
+# Plain column rows: the response model serializes them directly, so there is no need for
+# ORM entities (identity map, change tracking) per message.
+_MESSAGE_COLUMNS = (
+    MessageHistory.id, MessageHistory.client_id, MessageHistory.role,
+    MessageHistory.content, MessageHistory.timestamp
+)
+
 class MessageResponse(BaseModel):
     id: int
     client_id: str
@@ -17,47 +29,59 @@ class MessageResponse(BaseModel):
     content: str
     timestamp: datetime
 
-    class Config:
-        from_attributes = True  # Pydantic v2 replacement for orm_mode
-
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+    model_config = ConfigDict(from_attributes=True)
 
 @router.get("/", response_model=List[MessageResponse])
-def get_message_history(
+async def get_message_history(
     client_id: Optional[str] = Query(None),
     role: Optional[str] = Query(None),
     limit: int = 100,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """
     GET /message-history/?client_id=foo&role=user
     Returns up to `limit` most recent messages (desc by timestamp).
     """
-    query = db.query(MessageHistory)
+    query = select(*_MESSAGE_COLUMNS)
     if client_id:
-        query = query.filter(MessageHistory.client_id == client_id)
+        query = query.where(MessageHistory.client_id == client_id)
     if role:
-        query = query.filter(MessageHistory.role == role)
+        query = query.where(MessageHistory.role == role)
     query = query.order_by(MessageHistory.timestamp.desc()).limit(limit)
-    return query.all()
+    return (await db.execute(query)).all()
 
 @router.get("/{client_id}", response_model=List[MessageResponse])
-def get_message_history_by_id(client_id: str, db: Session = Depends(get_db)):
+async def get_message_history_by_id(client_id: str):
     """
     GET /message-history/{client_id}
     Returns all messages for that client_id, sorted ascending.
+    Streamed from a server-side cursor HISTORY_CHUNK rows at a time, so memory stays flat
+    however long the history is.
     """
-    messages = (
-        db.query(MessageHistory)
-        .filter(MessageHistory.client_id == client_id)
+    stmt = (
+        select(*_MESSAGE_COLUMNS)
+        .where(MessageHistory.client_id == client_id)
         .order_by(MessageHistory.timestamp.asc())
-        .all()
+        .execution_options(yield_per=HISTORY_CHUNK)
     )
-    if not messages:
+    # The generator outlives this handler, so it owns its session rather than using get_db
+    db = SessionLocal()
+    try:
+        partitions = (await db.stream(stmt)).partitions()
+        first = await anext(partitions, None)
+    except Exception:
+        await db.close()
+        raise
+    if first is None:
+        await db.close()
         raise HTTPException(status_code=404, detail="No messages found for this client_id")
-    return messages
+    return StreamingResponse(_history_json(db, first, partitions), media_type="application/json")
+
+async def _history_json(db: AsyncSession, first, partitions):
+    try:
+        yield b"[" + orjson.dumps([row._asdict() for row in first])[1:-1]
+        async for chunk in partitions:
+            yield b"," + orjson.dumps([row._asdict() for row in chunk])[1:-1]
+        yield b"]"
+    finally:
+        await db.close()
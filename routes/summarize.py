@@ -1,49 +1,65 @@
 # routes/summarize.py
 
+import asyncio
 from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
-from database import SessionLocal
-from models import MessageHistory
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import get_db
+from models import MessageHistory, IS_CHAT_MESSAGE, utcnow
 from summarization import summarize_messages   # root‐level import
-from datetime import datetime
 from typing import List
 
 router = APIRouter(tags=["Summarization"])
 
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+# Most messages sent to the summarizer in one call
+SUMMARY_WINDOW = 500
 
 @router.post("/summarize-context/{client_id}")
-def summarize_context(client_id: str, db: Session = Depends(get_db)):
+async def summarize_context(client_id: str, db: AsyncSession = Depends(get_db)):
     """
     POST /summarize-context/{client_id}
-    Summarize all user/assistant messages for the given client_id.
+    Summarize the client's user/assistant messages since the latest summary, folding that
+    summary in, so each call only sends the new window instead of the whole history.
     Stores the summary back into MessageHistory (role="summary").
     """
-    # 1. Fetch all user & assistant messages (chronological)
-    messages = (
-        db.query(MessageHistory)
-        .filter(
-            MessageHistory.client_id == client_id,
-            MessageHistory.role.in_(["user", "assistant"])
+    return await summarize_client_context(db, client_id)
+
+async def summarize_client_context(db: AsyncSession, client_id: str, commit: bool = True) -> dict:
+    """
+    The work behind POST /summarize-context. With commit=False the summary row is only
+    flushed, so callers can fold it into their own transaction.
+    """
+    # 1. Latest summary, then at most SUMMARY_WINDOW newer user & assistant messages
+    previous = (
+        await db.execute(
+            select(MessageHistory.content, MessageHistory.timestamp)
+            .where(MessageHistory.client_id == client_id, MessageHistory.role == "summary")
+            .order_by(MessageHistory.timestamp.desc())
+            .limit(1)
         )
-        .order_by(MessageHistory.timestamp.asc())
-        .all()
+    ).first()
+
+    query = select(MessageHistory.role, MessageHistory.content).where(
+        MessageHistory.client_id == client_id, IS_CHAT_MESSAGE
     )
+    if previous:
+        query = query.where(MessageHistory.timestamp > previous.timestamp)
+    messages = (
+        await db.execute(query.order_by(MessageHistory.timestamp.desc()).limit(SUMMARY_WINDOW))
+    ).all()[::-1]  # back to chronological
 
     if not messages:
+        if previous:
+            return {"summary": previous.content}  # nothing new since the last summary
         raise HTTPException(status_code=404, detail="No messages found for this client_id")
 
-    # 2. Convert them to simple dicts
-    chat = [{"role": m.role, "content": m.content} for m in messages]
+    # 2. Convert them to simple dicts, prior summary first
+    chat = [{"role": "summary", "content": previous.content}] if previous else []
+    chat += [{"role": m.role, "content": m.content} for m in messages]
 
     # 3. Call the summarizer
     try:
-        summary = summarize_messages(chat)
+        summary = await asyncio.to_thread(summarize_messages, chat)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Summarization error: {e}")
 
@@ -52,9 +68,12 @@ def summarize_context(client_id: str, db: Session = Depends(get_db)):
         client_id=client_id,
         role="summary",
         content=summary,
-        timestamp=datetime.utcnow()
+        timestamp=utcnow()
     )
     db.add(summary_entry)
-    db.commit()
+    if commit:
+        await db.commit()
+    else:
+        await db.flush()
 
     return {"summary": summary}
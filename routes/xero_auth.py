@@ -1,7 +1,9 @@
 # routes/xero_auth.py
 from fastapi import APIRouter, Request
 from fastapi.responses import RedirectResponse, PlainTextResponse
-import os, json, requests, asyncio
+import os, asyncio
+from urllib.parse import urlencode, quote
+from tools.xero_utils import save_credentials, xero_http
 
 router = APIRouter()
 
@@ -16,41 +18,43 @@ XERO_SCOPES = [
     "accounting.attachments"   # <-- THIS IS THE ONE THAT ENABLES ATTACHMENT UPLOADS!
 ]
 
+# Fixed for the life of the process, so built (and escaped) once; quote keeps spaces as %20
+_AUTHORIZE_URL = "https://login.xero.com/identity/connect/authorize?" + urlencode(
+    {
+        "response_type": "code",
+        "client_id": CLIENT_ID,
+        "redirect_uri": REDIRECT_URI,
+        "scope": " ".join(XERO_SCOPES),
+    },
+    quote_via=quote
+)
+
 @router.get("/xero/connect")
 def connect():
-    scopes_str = "%20".join(XERO_SCOPES)
-    url = (
-        "https://login.xero.com/identity/connect/authorize"
-        f"?response_type=code&client_id={CLIENT_ID}"
-        f"&redirect_uri={REDIRECT_URI}"
-        f"&scope={scopes_str}"
-    )
-    return RedirectResponse(url)
+    return RedirectResponse(_AUTHORIZE_URL)
 
 @router.get("/xero/callback")
 async def callback(request: Request):
     code = request.query_params["code"]
-    # Exchange code for tokens (sync HTTP ok here)
-    resp = requests.post(
+    # Exchange code for tokens (over the tools' shared Xero client, so the event loop never
+    # blocks on Xero; its JSON Content-Type default is overridden for the form body)
+    resp = await xero_http.post(
         "https://identity.xero.com/connect/token",
         data={
           "grant_type":"authorization_code",
           "code":code,
           "redirect_uri":REDIRECT_URI,
         },
+        headers={"Content-Type": "application/x-www-form-urlencoded"},
         auth=(CLIENT_ID, CLIENT_SECRET),
     )
     tokens = resp.json()
-    # Save tokens (async, in thread pool)
-    def _write_tokens(tokens):
-        with open("/app/xero_token.json", "w") as f:
-            json.dump(tokens, f)
-    await asyncio.to_thread(_write_tokens, tokens)
 
     # Grab the first tenant (your org)
-    tenant_id = requests.get(
+    connections = await xero_http.get(
       "https://api.xero.com/connections",
       headers={"Authorization":f"Bearer {tokens['access_token']}"}
-    ).json()[0]["tenantId"]
-    await asyncio.to_thread(lambda: open("/app/xero_tenant_id.txt", "w").write(tenant_id))
+    )
+    tenant_id = connections.json()[0]["tenantId"]
+    await asyncio.to_thread(save_credentials, tokens, tenant_id)
     return PlainTextResponse("✔️ Xero tokens saved.")
@@ -19,6 +19,3 @@ class ModelContext(BaseModel):
     messages: List[MessageItem]
     tool_inputs: Optional[Dict[str, Any]] = None
     tools: Optional[List[ToolDefinition]] = None  # ← new field
-
-    class Config:
-        json_encoders = {datetime: lambda v: v.isoformat()}
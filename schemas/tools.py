@@ -1,6 +1,6 @@
 # schemas/tools.py
 
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, ConfigDict, Field
 from typing import Dict, Any, List, Optional
 
 
@@ -21,5 +21,4 @@ class ToolInvocation(BaseModel):
     vat_rate:       float                       # VAT percentage, e.g. 8.10
 
 class ToolResult(BaseModel):
-    class Config:
-        extra = "allow"                        # allow extra fields (for tool responses)
+    model_config = ConfigDict(extra="allow")   # allow extra fields (for tool responses)
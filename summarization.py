@@ -1,14 +1,17 @@
 # summarization.py
 
-import os
-from dotenv import load_dotenv
-from openai import OpenAI
+import hashlib
+import threading
+from cachetools import LRUCache
+from openai_client import client  # shared pooled client (loads OPENAI_API_KEY from .env)
 
-# Load OPENAI_API_KEY from .env
-load_dotenv()
+SUMMARY_MODEL = "gpt-4o-mini"  # adjust if you prefer a different model
+SUMMARY_MAX_TOKENS = 512       # caps runaway summaries; output length dominates latency
 
-# Initialize OpenAI client
-client = OpenAI()
+# Summaries are deterministic (temperature=0), so identical conversations are only sent once.
+# Keyed by a hash of the model + conversation text; per process, guarded for worker threads.
+_summary_cache: LRUCache = LRUCache(maxsize=1024)
+_summary_cache_lock = threading.Lock()
 
 def summarize_messages(messages: list[dict]) -> str:
     """
@@ -16,12 +19,16 @@ def summarize_messages(messages: list[dict]) -> str:
     build a single conversation string, call the LLM to summarize it,
     and return the summary text.
     """
-    # 1. Build a plain-text conversation history
-    conversation = ""
-    for msg in messages:
-        role = msg.get("role", "unknown")
-        content = msg.get("content", "")
-        conversation += f"{role}: {content}\n"
+    # 1. Build a plain-text conversation history (one join, not repeated +=)
+    conversation = "".join(
+        f"{msg.get('role', 'unknown')}: {msg.get('content', '')}\n" for msg in messages
+    )
+
+    key = hashlib.blake2b(f"{SUMMARY_MODEL}\0{conversation}".encode(), digest_size=16).hexdigest()
+    with _summary_cache_lock:
+        cached = _summary_cache.get(key)
+    if cached is not None:
+        return cached
 
     # 2. Create a system/user prompt for summarization
     system_message = (
@@ -32,14 +39,17 @@ def summarize_messages(messages: list[dict]) -> str:
 
     # 3. Call the model
     response = client.chat.completions.create(
-        model="gpt-4o-mini",  # adjust if you prefer a different model
+        model=SUMMARY_MODEL,
         messages=[
             {"role": "system", "content": system_message},
             {"role": "user", "content": user_message},
         ],
         temperature=0,
+        max_tokens=SUMMARY_MAX_TOKENS,
     )
 
     # 4. Extract and return the summary
     summary_text = response.choices[0].message.content
+    with _summary_cache_lock:
+        _summary_cache[key] = summary_text
     return summary_text
@@ -0,0 +1,11 @@
+import diskcache
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def completion_cache(tmp_path, monkeypatch):
+    """A fresh extraction cache per test, so no completion is replayed from ./llm_cache."""
+    cache = diskcache.Cache(str(tmp_path / "llm_cache"))
+    monkeypatch.setattr("tools.parse_invoice._get_completion_cache", lambda: cache)
+    yield cache
+    cache.close()
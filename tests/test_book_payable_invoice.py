@@ -0,0 +1,42 @@
+from datetime import date
+
+import pytest
+
+from tools.book_payable_invoice import _fast_parse_date, _index_rates
+
+
+@pytest.mark.parametrize("raw, expected", [
+    ("2024-03-05", date(2024, 3, 5)),
+    (" 2024-03-05 ", date(2024, 3, 5)),
+    ("2024-3-5", date(2024, 3, 5)),
+    ("2024/03/05", date(2024, 3, 5)),
+    ("2024-03-05T10:00:00", date(2024, 3, 5)),
+    ("05/03/2024", date(2024, 3, 5)),
+    ("5/3/2024", date(2024, 3, 5)),
+    ("05.03.2024", date(2024, 3, 5)),
+    ("5.3.2024", date(2024, 3, 5)),
+    ("31.12.2024", date(2024, 12, 31)),
+    ("5 March 2024", date(2024, 3, 5)),
+])
+def test_fast_parse_date(raw, expected):
+    assert _fast_parse_date(raw) == expected
+
+
+@pytest.mark.parametrize("raw", ["", "not a date", "32.13.2024", "2024-02-30"])
+def test_fast_parse_date_rejects_invalid(raw):
+    with pytest.raises(ValueError):
+        _fast_parse_date(raw)
+
+
+def test_index_rates_maps_component_rates_to_tax_types():
+    rates = [
+        {"TaxType": "INPUT", "TaxComponents": [{"Rate": 8.1}]},
+        {"TaxType": "TAX002", "TaxComponents": [{"Rate": 2.6}, {"Rate": 8.1}]},
+        {"TaxType": "NONE", "TaxComponents": [{}]},
+        {"TaxType": "EMPTY"},
+    ]
+    assert _index_rates(rates) == {8.1: "INPUT", 2.6: "TAX002", 0: "NONE"}
+
+
+def test_index_rates_rounds_rates():
+    assert _index_rates([{"TaxType": "T", "TaxComponents": [{"Rate": 7.70000001}]}]) == {7.7: "T"}
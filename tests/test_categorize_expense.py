@@ -0,0 +1,34 @@
+from tools.categorize_expense import categorize_expenses_batch
+
+ACCOUNTS = [
+    {"name": "Office Supplies", "code": "410"},
+    {"name": "General Expenses", "code": "400"},
+    {"name": "Travel", "code": "420"},
+]
+
+
+def _codes(result):
+    return [c["account_code"] for c in result["categories"]]
+
+
+def test_results_follow_input_order():
+    results = categorize_expenses_batch([
+        {"allowed_accounts": ACCOUNTS, "line_items": [{"description": "office supplies"}, {"description": "Travel"}]},
+        {"allowed_accounts": ACCOUNTS[1:], "line_items": [{"description": "travel"}]},
+        {"allowed_accounts": ACCOUNTS, "line_items": []},
+        {"allowed_accounts": ACCOUNTS, "line_items": [{"description": "OFFICE SUPPLIES!"}]},
+    ])
+    assert [_codes(r) for r in results] == [["410", "420"], ["420"], [], ["410"]]
+
+
+def test_unmatched_items_fall_back_to_general_expenses():
+    (result,) = categorize_expenses_batch([
+        {"allowed_accounts": ACCOUNTS, "line_items": [{"description": "zzzz"}, {"description": None}]},
+    ])
+    assert _codes(result) == ["400", "400"]
+    assert result["categories"][0]["description"] == "zzzz"
+
+
+def test_no_allowed_accounts():
+    (result,) = categorize_expenses_batch([{"line_items": [{"description": "Travel"}]}])
+    assert result["categories"][0]["account_name"] == "General Expenses"
@@ -1,12 +1,26 @@
 import io
-from http import client
-from unittest.mock import patch
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, patch
 
-@patch("main.client.chat.completions.create")
-def test_process_invoice_with_mock(mock_openai):
-    mock_openai.return_value.choices = [
-        type("obj", (object,), {"message": type("msg", (object,), {"content": '{"invoice_number": "12345"}'})()})()
-    ]
+from fastapi.testclient import TestClient
+from main import app
+
+client = TestClient(app)
+
+
+def _completion(content):
+    return SimpleNamespace(
+        choices=[SimpleNamespace(message=SimpleNamespace(content=content))],
+        usage=None,
+    )
+
+
+@patch("tools.parse_invoice._read_text", return_value="Invoice 12345")
+@patch("tools.parse_invoice.client.chat.completions.create")
+@patch("openai_client.async_client.chat.completions.create", new_callable=AsyncMock)
+def test_process_invoice_with_mock(mock_select, mock_extract, mock_read_text):
+    mock_select.return_value = _completion('{"tool": "parse_invoice"}')
+    mock_extract.return_value = _completion('{"invoice_number": "12345"}')
 
     file_content = io.BytesIO(b"fake image bytes")
     response = client.post(
@@ -17,3 +31,4 @@ def test_process_invoice_with_mock(mock_openai):
     assert response.status_code == 200
     data = response.json()
     assert data["structured_data"]["invoice_number"] == "12345"
+    mock_extract.assert_called_once()
@@ -0,0 +1,28 @@
+import pytest
+
+from tools.parse_invoice import _load_json, _parse_num
+
+
+@pytest.mark.parametrize("raw, expected", [
+    (12.5, 12.5),
+    ("12.50", 12.5),
+    ("1'234.50", 1234.5),
+    ("1 234,50", 1234.5),
+    ("CHF 99.90", 99.9),
+    ("-5", -5.0),
+    ("", 0.0),
+    (None, 0.0),
+    ("n/a", 0.0),
+])
+def test_parse_num(raw, expected):
+    assert _parse_num(raw) == expected
+
+
+def test_load_json():
+    assert _load_json('{"total": 5}') == {"total": 5}
+
+
+@pytest.mark.parametrize("raw", ["", None, '{"total":'])
+def test_load_json_raises_with_raw_text(raw):
+    with pytest.raises(ValueError, match="invalid JSON"):
+        _load_json(raw)
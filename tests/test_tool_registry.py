@@ -0,0 +1,26 @@
+import orjson
+
+from tool_registry import TOOL_SELECTION_INSTRUCTIONS, ToolRegistry
+
+
+def _registry():
+    registry = ToolRegistry()
+    registry.register("first_tool", lambda inputs: {}, "First.", {"x": "int"})
+    registry.register("second_tool", lambda inputs: {}, "Second.", {"y": "int"})
+    return registry
+
+
+def test_selection_prompt():
+    registry = _registry()
+    prompt = registry.selection_prompt()
+    assert prompt.startswith(TOOL_SELECTION_INSTRUCTIONS)
+    tools = orjson.loads(prompt[len(TOOL_SELECTION_INSTRUCTIONS):])
+    assert [t["name"] for t in tools] == ["first_tool", "second_tool"]
+    assert registry.selection_prompt() is prompt  # cached until the next register()
+
+
+def test_selection_prompt_includes_tools_registered_later():
+    registry = _registry()
+    registry.selection_prompt()
+    registry.register("late_tool", lambda inputs: {}, "Late.", {})
+    assert '"late_tool"' in registry.selection_prompt()
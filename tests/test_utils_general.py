@@ -0,0 +1,24 @@
+import pytest
+
+from utils_general import extract_json_from_text
+
+
+@pytest.mark.parametrize("text", [
+    '{"tool": "parse_invoice"}',
+    '  {"tool": "parse_invoice"}\n',
+    '```json\n{"tool": "parse_invoice"}\n```',
+    '```\n{"tool": "parse_invoice"}\n```',
+    'Sure! Here it is: {"tool": "parse_invoice"} Let me know.',
+])
+def test_extracts_json(text):
+    assert extract_json_from_text(text) == {"tool": "parse_invoice"}
+
+
+def test_unparseable_block():
+    result = extract_json_from_text("{tool: parse_invoice}")
+    assert result["error"] == "Failed to parse extracted JSON"
+    assert result["raw_response"] == "{tool: parse_invoice}"
+
+
+def test_no_json_block():
+    assert extract_json_from_text("no json here")["error"] == "Failed to find JSON block"
@@ -0,0 +1,64 @@
+import asyncio
+
+import httpx
+
+from tools import xero_utils
+from tools.xero_utils import _RetryTransport
+
+
+def _send(method, statuses, monkeypatch):
+    calls = []
+
+    def handler(request):
+        calls.append(request.method)
+        return httpx.Response(statuses[min(len(calls), len(statuses)) - 1])
+
+    async def no_sleep(_):
+        pass
+
+    monkeypatch.setattr(xero_utils.asyncio, "sleep", no_sleep)
+
+    async def run():
+        async with httpx.AsyncClient(transport=_RetryTransport(httpx.MockTransport(handler))) as http:
+            return await http.request(method, "https://api.xero.com/api.xro/2.0/Invoices")
+
+    return asyncio.run(run()), calls
+
+
+def test_post_is_not_retried_on_503(monkeypatch):
+    response, calls = _send("POST", [503, 200], monkeypatch)
+    assert response.status_code == 503
+    assert calls == ["POST"]
+
+
+def test_put_is_retried_on_429(monkeypatch):
+    response, calls = _send("PUT", [429, 200], monkeypatch)
+    assert response.status_code == 200
+    assert calls == ["PUT", "PUT"]
+
+
+def test_get_is_retried_on_503(monkeypatch):
+    response, calls = _send("GET", [503, 502, 200], monkeypatch)
+    assert response.status_code == 200
+    assert len(calls) == 3
+
+
+def test_retries_stop_after_limit(monkeypatch):
+    response, calls = _send("GET", [503], monkeypatch)
+    assert response.status_code == 503
+    assert len(calls) == xero_utils.XERO_RETRIES + 1
+
+
+def test_long_retry_after_is_returned(monkeypatch):
+    calls = []
+
+    def handler(request):
+        calls.append(request.method)
+        return httpx.Response(429, headers={"Retry-After": "3600"})
+
+    async def run():
+        async with httpx.AsyncClient(transport=_RetryTransport(httpx.MockTransport(handler))) as http:
+            return await http.get("https://api.xero.com/api.xro/2.0/Invoices")
+
+    assert asyncio.run(run()).status_code == 429
+    assert len(calls) == 1
@@ -1,38 +1,112 @@
 # tool_registry.py
 
-from typing import Dict, Any, Callable
+import orjson
+import logging
+from types import MappingProxyType
+from typing import Dict, Any, Callable, List, Mapping, Optional
+from schemas.tools import ToolDefinition
 from tools.describe_invoice import describe_invoice_tool
 
+logger = logging.getLogger(__name__)
+
 # A type alias: a “tool” is any function that takes a dict and returns a dict.
 ToolFn = Callable[[Dict[str, Any]], Dict[str, Any]]
 
+# Static head of every tool-selection prompt (see selection_prompt()). Keep it byte-stable:
+# OpenAI's prompt cache only reuses identical prefixes.
+TOOL_SELECTION_INSTRUCTIONS = (
+    "You are an AI accounting assistant that routes each request to exactly one tool. "
+    "The next system message holds the client's memory and recent messages. "
+    "Available tools (JSON):\n"
+)
+
+class ToolEntry:
+    """One registered tool. Slotted: no per-entry __dict__, plain attribute access."""
+    __slots__ = ("fn", "description", "input_schema", "definition")
+
+    def __init__(self, name: str, fn: ToolFn, description: str, input_schema: Dict[str, Any]):
+        self.fn = fn
+        self.description = description
+        self.input_schema = input_schema
+        # Schemas don't change after registration, so the model is built once here
+        self.definition = ToolDefinition(name=name, description=description, input_schema=input_schema)
+
 class ToolRegistry:
     def __init__(self):
-        self._registry: Dict[str, Dict[str, Any]] = {}
+        self._registry: Dict[str, ToolEntry] = {}
+        self._fns: Dict[str, ToolFn] = {}  # name -> fn, flat so call() is a single lookup
+        self._tools: Optional[Mapping[str, Dict[str, Any]]] = None
+        self._definitions: Optional[List[ToolDefinition]] = None
+        self._definitions_json: Optional[str] = None
+        self._selection_prompt: Optional[str] = None
 
     def register(self, name: str, fn: ToolFn, description: str, input_schema: Dict[str, Any]):
         if name in self._registry:
             raise KeyError(f"Tool '{name}' is already registered")
-        self._registry[name] = {
-            "fn": fn,
-            "description": description,
-            "input_schema": input_schema
-        }
+        self._registry[name] = ToolEntry(name, fn, description, input_schema)
+        self._fns[name] = fn
+        self._tools = None        # invalidate cached list_tools()
+        self._definitions = None  # invalidate cached ToolDefinitions
+        self._definitions_json = None
+        self._selection_prompt = None
 
     def call(self, name: str, inputs: Dict[str, Any]) -> Dict[str, Any]:
+        fn = self._fns.get(name)
+        if fn is None:
+            raise KeyError(f"Tool '{name}' not registered")
+        return fn(inputs)
+
+    def list_tools(self) -> Mapping[str, Dict[str, Any]]:
+        """
+        name -> {description, input_schema} for every tool, built once per register().
+        Returned as a read-only mapping since it is shared between callers.
+        """
+        if self._tools is None:
+            self._tools = MappingProxyType({
+                name: {
+                    "description": entry.description,
+                    "input_schema": entry.input_schema
+                }
+                for name, entry in self._registry.items()
+            })
+        return self._tools
+
+    def get_definition(self, name: str) -> ToolDefinition:
+        """The tool's ToolDefinition, built at register() time. Treat it as read-only."""
         entry = self._registry.get(name)
-        if not entry:
+        if entry is None:
             raise KeyError(f"Tool '{name}' not registered")
-        return entry["fn"](inputs)
+        return entry.definition
+
+    def list_definitions(self) -> List[ToolDefinition]:
+        """
+        ToolDefinition models for every registered tool, built once and reused
+        until the next register(). Treat the returned list as read-only.
+        """
+        if self._definitions is None:
+            self._definitions = [entry.definition for entry in self._registry.values()]
+        return self._definitions
 
-    def list_tools(self) -> Dict[str, Dict[str, Any]]:
-        return {
-            name: {
-                "description": meta["description"],
-                "input_schema": meta["input_schema"]
-            }
-            for name, meta in self._registry.items()
-        }
+    def definitions_json(self) -> str:
+        """
+        JSON of list_definitions(), cached. Byte-identical between register() calls,
+        which keeps it usable as a stable (prompt-cacheable) LLM prompt prefix.
+        """
+        if self._definitions_json is None:
+            # orjson: compact and raw UTF-8, i.e. fewer prompt tokens on every tool-selection call
+            self._definitions_json = orjson.dumps(
+                [d.model_dump() for d in self.list_definitions()]
+            ).decode()
+        return self._definitions_json
+
+    def selection_prompt(self) -> str:
+        """
+        Complete static system message for LLM tool selection (instructions + tool JSON),
+        built once per register() rather than concatenated on every request.
+        """
+        if self._selection_prompt is None:
+            self._selection_prompt = TOOL_SELECTION_INSTRUCTIONS + self.definitions_json()
+        return self._selection_prompt
 
 # ─── Instantiate & register ────────────────────────────────────────────────────
 
@@ -46,7 +120,7 @@ tool_registry.register(
     name="parse_invoice",
     fn=parse_invoice_tool,
     description="Given a base64-encoded PDF, return supplier, date, invoice_number, total, vat.",
-    input_schema={"file_bytes": "base64 string of the PDF"}
+    input_schema={"file_bytes": "base64 string of the PDF (or file_path / raw_bytes, in-process only)"}
 )
 
 tool_registry.register(
@@ -89,5 +163,4 @@ tool_registry.register(
     }
 )
 
-
-print("✅ Registered tools:", list(tool_registry.list_tools().keys()))
+logger.debug("Registered tools: %s", list(tool_registry._fns))
@@ -1,109 +1,153 @@
 # tools/book_payable_invoice.py
 
 import os
-import json
+import orjson
 import base64
 import logging
-import anyio
 import asyncio
 import httpx
-from datetime import datetime, timedelta
-from dateutil.parser import parse as _parse_date
-from requests import HTTPError
+from cachetools import TTLCache
+from datetime import date, timedelta
 from .xero_accounts import ensure_account_for_category_existing_only
-from .xero_utils import _get_headers, XeroToolError
+from .xero_utils import TOKEN_FILE, save_tokens, _get_headers, _get_tokens, token_expiring, invalidate_headers, XeroToolError, xero_http
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 # --- Constants ---
-TOKEN_FILE     = "/app/xero_token.json"
-TENANT_FILE    = "/app/xero_tenant_id.txt"
 TOKEN_URL      = "https://identity.xero.com/connect/token"
 INVOICE_URL    = "https://api.xero.com/api.xro/2.0/Invoices"
 TAXRATES_URL   = "https://api.xero.com/api.xro/2.0/TaxRates"
 ATTACHMENT_URL_FMT = "https://api.xero.com/api.xro/2.0/Invoices/{invoice_id}/Attachments/{filename}"
+ATTACHMENT_RETRY_DELAYS = (0, 0.1, 0.25, 0.5)  # seconds before each attachment PUT attempt
+BULK_INVOICE_URL = INVOICE_URL + "?summarizeErrors=false"
+BULK_INVOICE_LIMIT = 50  # Xero's recommended maximum invoices per request
+
+# Xero allows at most 5 concurrent requests per tenant; bulk POSTs and attachment uploads
+# share this bound
+_xero_sem = asyncio.Semaphore(5)
+
+# Fields that are the same on every booked invoice
+_INVOICE_TEMPLATE = {
+    "Type":            "ACCPAY",
+    "LineAmountTypes": "Exclusive",
+    "Status":          "DRAFT",
+}
+
+# TaxType per VAT rate (rounded to 4 places). Batches mostly share a few rates, so only the
+# first invoice at each rate pays for the TaxRates GET (and possible PUT). The lock is held
+# across the lookup so concurrent bookings at a new rate don't each create a TaxRate.
+# Built-in Xero TaxTypes that need no lookup at all
+_KNOWN_TAX_TYPES = {0.0: "NONE"}
+_tax_type_cache: TTLCache = TTLCache(maxsize=256, ttl=3600)
+_tax_type_lock = asyncio.Lock()
 
 # INTEGRATION REQUIREMENT:
 # You MUST have `accounting.attachments` in your Xero app scopes, AND you must re-authenticate
 # after adding it. Otherwise, attachments will always return 401 Unauthorized.
 
-class XeroToolError(Exception):
-    def __init__(self, message, xero_response=None):
-        self.xero_response = xero_response
-        super().__init__(message)
-
 def _save_tokens(tokens: dict):
     try:
-        with open(TOKEN_FILE, "w") as f:
-            json.dump(tokens, f)
-            os.fsync(f.fileno())
+        save_tokens(tokens)
     except Exception as e:
         logger.error(f"Failed to save tokens: {e}")
         raise XeroToolError("Token storage failed")
 
-def _load_tokens() -> dict:
-    try:
-        with open(TOKEN_FILE, "r") as f:
-            return json.load(f)
-    except FileNotFoundError:
-        raise XeroToolError("Authentication required - no token found")
-    except json.JSONDecodeError:
-        raise XeroToolError("Corrupted token file - please reauthenticate")
-
-def _refresh_access_token(tokens: dict) -> dict:
-    client_id = os.getenv("XERO_CLIENT_ID")
-    client_secret = os.getenv("XERO_CLIENT_SECRET")
-    if not all([client_id, client_secret]):
-        raise XeroToolError("Missing Xero API credentials")
-    auth = base64.b64encode(f"{client_id}:{client_secret}".encode()).decode()
+_basic_auth = None  # "Basic <base64 client_id:client_secret>", built on first refresh
+
+def _get_basic_auth() -> str:
+    """The app credentials don't change at runtime, so read and encode them once."""
+    global _basic_auth
+    if _basic_auth is None:
+        client_id = os.getenv("XERO_CLIENT_ID")
+        client_secret = os.getenv("XERO_CLIENT_SECRET")
+        if not all([client_id, client_secret]):
+            raise XeroToolError("Missing Xero API credentials")
+        _basic_auth = "Basic " + base64.b64encode(f"{client_id}:{client_secret}".encode()).decode()
+    return _basic_auth
+
+async def _refresh_access_token(tokens: dict) -> dict:
     headers = {
-        "Authorization": f"Basic {auth}",
+        "Authorization": _get_basic_auth(),
         "Content-Type":  "application/x-www-form-urlencoded"
     }
-    resp = httpx.post(
+    resp = await xero_http.post(
         TOKEN_URL,
         headers=headers,
         data={"grant_type": "refresh_token", "refresh_token": tokens["refresh_token"]}
     )
-    if resp.status_code == 400 and resp.json().get("error") == "invalid_grant":
-        os.remove(TOKEN_FILE)
+    if resp.status_code == 400 and orjson.loads(resp.content).get("error") == "invalid_grant":
+        await asyncio.to_thread(os.remove, TOKEN_FILE)
         raise XeroToolError("Refresh token expired - please reauthenticate")
     resp.raise_for_status()
-    new_tokens = resp.json()
-    _save_tokens(new_tokens)
+    new_tokens = orjson.loads(resp.content)
+    await asyncio.to_thread(_save_tokens, new_tokens)  # file IO stays off the event loop
     return new_tokens
 
-def _get_headers() -> dict:
-    tokens = _load_tokens()
-    with open(TENANT_FILE, "r") as f:
-        tenant_id = f.read().strip()
-    return {
-        "Authorization":   f"Bearer {tokens['access_token']}",
-        "Xero-tenant-id":  tenant_id,
-        "Content-Type":    "application/json",
-        "Accept":          "application/json"
-    }
+# Xero rotates the refresh token on every use, so two concurrent refreshes would race and the
+# loser would see invalid_grant. Every refresh (proactive or after a 401) is serialized and re-checked.
+_refresh_lock = asyncio.Lock()
+
+async def _ensure_fresh_token():
+    """Refresh ahead of expiry rather than waiting for a 401 on the first call that needs it."""
+    if not token_expiring():
+        return
+    async with _refresh_lock:
+        invalidate_headers()  # re-read the file: another worker may have refreshed already
+        if token_expiring():  # another booking may have refreshed while we waited
+            await _refresh_access_token(_get_tokens())
+
+async def _refresh_after_401(stale_headers: dict) -> dict:
+    """
+    Refresh after a 401 unless a concurrent call already has: only the first request to see
+    the rejected access token spends the refresh token. Returns the headers to retry with.
+    """
+    async with _refresh_lock:
+        invalidate_headers()  # re-read the file: another worker may have refreshed already
+        if _get_headers()["Authorization"] == stale_headers["Authorization"]:
+            await _refresh_access_token(_get_tokens())
+        return _get_headers()
+
+async def _get_or_create_tax_type(vat_rate: float) -> str:
+    key = round(float(vat_rate), 4)
+    known = _KNOWN_TAX_TYPES.get(key)
+    if known is not None:
+        return known
+    async with _tax_type_lock:
+        tax_type = _tax_type_cache.get(key)
+        if tax_type is None:
+            tax_type = _tax_type_cache[key] = await _lookup_or_create_tax_type(vat_rate)
+        return tax_type
+
+def _index_rates(rates: list) -> dict:
+    """{rounded component rate: TaxType}; the first TaxRate listing a rate wins, as before."""
+    index = {}
+    for tr in rates:
+        for comp in tr.get("TaxComponents", []):
+            index.setdefault(round(comp.get("Rate", 0), 4), tr["TaxType"])
+    return index
 
-def _get_or_create_tax_type(vat_rate: float) -> str:
-    def _fetch_rates():
+async def _lookup_or_create_tax_type(vat_rate: float) -> str:
+    key = round(vat_rate, 4)
+
+    async def _fetch_rates() -> dict:
         headers = _get_headers()
         for attempt in range(2):
-            resp = httpx.get(TAXRATES_URL, headers=headers, timeout=15)
+            resp = await xero_http.get(TAXRATES_URL, headers=headers, timeout=15)
             if resp.status_code == 401 and attempt == 0:
-                _refresh_access_token(_load_tokens())
-                headers = _get_headers()
+                headers = await _refresh_after_401(headers)
                 continue
             resp.raise_for_status()
-            return resp.json().get("TaxRates", [])
+            index = _index_rates(orjson.loads(resp.content).get("TaxRates", []))
+            # One GET answers every rate the org has, so the caller's cache is primed for all of them
+            _tax_type_cache.update(index)
+            return index
         raise XeroToolError("Unauthorized fetching TaxRates", xero_response=resp.text)
 
-    existing = _fetch_rates()
-    for tr in existing:
-        for comp in tr.get("TaxComponents", []):
-            if abs(comp.get("Rate", 0) - vat_rate) < 1e-6:
-                return tr["TaxType"]
+    existing = await _fetch_rates()
+    if key in existing:
+        return existing[key]
 
     name = f"Expenses {vat_rate}%"
     payload = {
@@ -120,165 +164,261 @@ def _get_or_create_tax_type(vat_rate: float) -> str:
 
     headers = _get_headers()
     for attempt in range(2):
-        resp = httpx.put(TAXRATES_URL, headers=headers, json=payload, timeout=15)
+        resp = await xero_http.put(TAXRATES_URL, headers=headers, content=orjson.dumps(payload), timeout=15)
         if resp.status_code == 401 and attempt == 0:
-            _refresh_access_token(_load_tokens())
-            headers = _get_headers()
+            headers = await _refresh_after_401(headers)
             continue
         try:
             resp.raise_for_status()
-        except HTTPError:
+        except httpx.HTTPStatusError:
             if resp.status_code == 400:
-                existing = _fetch_rates()
-                for tr in existing:
-                    for comp in tr.get("TaxComponents", []):
-                        if abs(comp.get("Rate", 0) - vat_rate) < 1e-6:
-                            return tr["TaxType"]
+                existing = await _fetch_rates()
+                if key in existing:
+                    return existing[key]
             raise XeroToolError(f"Error creating TaxRate: {resp.text}", xero_response=resp.text)
-        created = resp.json()["TaxRates"][0]
+        created = orjson.loads(resp.content)["TaxRates"][0]
         return created["TaxType"]
 
     raise XeroToolError("Failed to create or fetch TaxRate", xero_response="")
 
+# (field, accepted types, pre-formatted type error), checked in one pass
+_FIELD_CHECKS = (
+    ("invoice_number", str,               "Invalid type for invoice_number - expected str"),
+    ("supplier",       str,               "Invalid type for supplier - expected str"),
+    ("date",           str,               "Invalid type for date - expected str"),
+    ("total",          (int, float, str), "Invalid type for total - expected number or numeric string"),
+    ("vat_rate",       (int, float, str), "Invalid type for vat_rate - expected number or numeric string"),
+    ("line_items",     list,              "At least one line item required"),
+)
+
 def _validate_invoice_data(inputs: dict):
-    required = ["invoice_number", "supplier", "date", "total", "vat_rate", "line_items"]
-    for key in required:
-        if key not in inputs or inputs[key] is None:
+    get = inputs.get
+    for key, types, type_error in _FIELD_CHECKS:
+        value = get(key)
+        if value is None:
             raise XeroToolError(f"Missing required field: {key}")
-    if not isinstance(inputs["invoice_number"], str):
-        raise XeroToolError("Invalid type for invoice_number - expected str")
-    if not isinstance(inputs["supplier"], str):
-        raise XeroToolError("Invalid type for supplier - expected str")
-    if not isinstance(inputs["date"], str):
-        raise XeroToolError("Invalid type for date - expected str")
-    if not isinstance(inputs["total"], (int, float, str)):
-        raise XeroToolError("Invalid type for total - expected number or numeric string")
-    if not isinstance(inputs["vat_rate"], (int, float, str)):
-        raise XeroToolError("Invalid type for vat_rate - expected number or numeric string")
-    if not isinstance(inputs["line_items"], list) or not inputs["line_items"]:
+        if not isinstance(value, types):
+            raise XeroToolError(type_error)
+    if not inputs["line_items"]:
         raise XeroToolError("At least one line item required")
 
-async def book_payable_invoice_tool(inputs: dict) -> dict:
-    await anyio.to_thread.run_sync(_validate_invoice_data, inputs)
+def _fast_parse_date(raw: str) -> date:
+    """
+    YYYY-MM-DD via the C date.fromisoformat, DD/MM/YYYY (or DD.MM.YYYY) by slicing the
+    fixed-width fields; anything else falls back to dateutil's (much slower) heuristics,
+    year-first when the string starts with a 4-digit year (2024-3-5) and day-first otherwise.
+    """
+    raw = raw.strip()
+    try:
+        if len(raw) == 10:
+            if raw[4] == "-" and raw[7] == "-":
+                return date.fromisoformat(raw)
+            if raw[2] in "./" and raw[5] == raw[2]:
+                return date(int(raw[6:10]), int(raw[3:5]), int(raw[:2]))
+    except ValueError:
+        pass
+    from dateutil.parser import parse as _parse_date  # only imported if ever needed
+    yearfirst = raw[:4].isdigit()
+    return _parse_date(raw, dayfirst=not yearfirst, yearfirst=yearfirst).date()
+
+def _error_body(resp: httpx.Response):
+    """Parsed JSON error from Xero, else the raw text; the body is only decoded once."""
+    body = resp.content
+    try:
+        return orjson.loads(body)
+    except orjson.JSONDecodeError:
+        return body.decode("utf-8", "replace")
 
+async def _build_invoice_dict(inputs: dict) -> dict:
+    """The inner Xero invoice object for one (validated) input dict."""
     try:
-        invoice_dt = _parse_date(inputs["date"], dayfirst=True)
+        invoice_date = _fast_parse_date(inputs["date"])
     except Exception:
         raise XeroToolError(f"Invalid date format: {inputs['date']}")
     due_input = inputs.get("due_date")
     if due_input:
         try:
-            due_dt = _parse_date(due_input, dayfirst=True)
+            due_date = _fast_parse_date(due_input)
         except Exception:
-            due_dt = invoice_dt + timedelta(days=30)
+            due_date = invoice_date + timedelta(days=30)
     else:
-        due_dt = invoice_dt + timedelta(days=30)
+        due_date = invoice_date + timedelta(days=30)
 
-    vat_rate = float(inputs["vat_rate"])
-    if vat_rate == 0:
-        tax_type = "NONE"
-    else:
-        tax_type = await anyio.to_thread.run_sync(_get_or_create_tax_type, vat_rate)
+    tax_type = await _get_or_create_tax_type(float(inputs["vat_rate"]))
+
+    # Resolve each distinct category once, then map every line item onto its code
+    categories = list(dict.fromkeys(
+        li.get("category") or "General Expenses" for li in inputs["line_items"]
+    ))
+    codes = dict(zip(categories, await asyncio.gather(
+        *[ensure_account_for_category_existing_only(c) for c in categories]
+    )))
+    for category, acct_code in codes.items():
+        logger.info("USING AccountCode %s for category '%s'", acct_code, category)
 
-    async def resolve_line_item(li):
-        category = li.get("category") or "General Expenses"
-        acct_code = await ensure_account_for_category_existing_only(category)
-        logger.info(f"USING AccountCode {acct_code} for category '{category}'")
-        return {
+    items = [
+        {
             "Description": li.get("description", ""),
             "Quantity": 1,
             "UnitAmount": float(li["amount"]),
-            "AccountCode": acct_code,
+            "AccountCode": codes[li.get("category") or "General Expenses"],
             "TaxType": tax_type
         }
+        for li in inputs["line_items"]
+    ]
 
-    items = await asyncio.gather(*[resolve_line_item(li) for li in inputs["line_items"]])
+    return {
+        **_INVOICE_TEMPLATE,
+        "Contact":         {"Name": inputs["supplier"]},
+        "Date":            invoice_date,  # orjson writes dates as YYYY-MM-DD
+        "DueDate":         due_date,
+        "LineItems":       items,
+        "InvoiceNumber":   inputs["invoice_number"],
+        "Reference":       inputs["invoice_number"],
+        "CurrencyCode":    inputs.get("currency_code", "CHF"),
+    }
 
-    payload = {
-        "Invoices": [{
-            "Type":            "ACCPAY",
-            "Contact":         {"Name": inputs["supplier"]},
-            "Date":            invoice_dt.strftime("%Y-%m-%d"),
-            "DueDate":         due_dt.strftime("%Y-%m-%d"),
-            "LineAmountTypes": "Exclusive",
-            "LineItems":       items,
-            "InvoiceNumber":   inputs["invoice_number"],
-            "Reference":       inputs["invoice_number"],
-            "CurrencyCode":    inputs.get("currency_code", "CHF"),
-            "Status":          "DRAFT"
-        }]
+async def _post_invoices(invoices: list, url: str = INVOICE_URL) -> list:
+    body = orjson.dumps({"Invoices": invoices})
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Xero payload: %s", body.decode())
+    # Headers are built once and only rebuilt after a 401-triggered refresh
+    headers = _get_headers()
+    for attempt in range(2):
+        resp = await xero_http.post(url, headers=headers, content=body)
+        if resp.status_code == 401 and attempt == 0:
+            headers = await _refresh_after_401(headers)
+            continue
+        break
+    try:
+        resp.raise_for_status()
+    except httpx.HTTPStatusError as e:
+        error_body = _error_body(resp)
+        raise XeroToolError(
+            f"Xero API error {resp.status_code}: {error_body}",
+            xero_response=error_body
+        ) from e
+    return orjson.loads(resp.content)["Invoices"]
+
+async def _upload_attachment(inv: dict, pdf_bytes) -> dict:
+    try:
+        # In-process callers may pass raw bytes; base64 (JSON callers) is decoded off the event loop
+        if not isinstance(pdf_bytes, (bytes, bytearray)):
+            # Decoded once straight into bytes, which httpx sends as-is (no further copy)
+            pdf_bytes = await asyncio.to_thread(base64.b64decode, pdf_bytes)
+        invoice_id = inv["InvoiceID"]
+        filename = f"Invoice_{inv['InvoiceNumber']}.pdf"
+        attachment_url = ATTACHMENT_URL_FMT.format(invoice_id=invoice_id, filename=filename)
+
+        # Fresh auth headers; Content-Type overrides xero_http's JSON default
+        attach_headers = {**_get_headers(), "Content-Type": "application/pdf"}
+
+        logger.debug("Attachment PUT %s (%d bytes)", attachment_url, len(pdf_bytes))
+
+        # Xero may be eventually consistent: PUT straight away, and only back off
+        # (~1s in total) while the new invoice is not yet visible
+        for delay in ATTACHMENT_RETRY_DELAYS:
+            if delay:
+                await asyncio.sleep(delay)
+            attach_resp = await xero_http.put(
+                attachment_url,
+                headers=attach_headers,
+                content=pdf_bytes
+            )
+            if attach_resp.status_code not in (404, 409):
+                break
+
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Attachment PUT status=%s len=%d", attach_resp.status_code, len(attach_resp.content))
+
+        try:
+            attach_resp.raise_for_status()
+            return {"attachment_status": "uploaded", "file_name": filename}
+        except httpx.HTTPStatusError:
+            return {
+                "attachment_status": "failed",
+                "error": attach_resp.text,
+                "response_status": attach_resp.status_code
+            }
+    except Exception as ex:
+        return {"attachment_status": "failed", "error": str(ex)}
+
+def _booking_result(inv: dict, attachment_result: dict | None) -> dict:
+    result = {
+        "xero_invoice_id": inv["InvoiceID"],
+        "status":          inv["Status"],
+        "total":           inv["Total"],
+        "due_date":        inv["DueDate"],
+        "reference":       inv.get("Reference"),
     }
+    if attachment_result:
+        result.update(attachment_result)
+    return result
 
-    async with httpx.AsyncClient(timeout=30) as client:
-        resp = await client.post(INVOICE_URL, headers=_get_headers(), json=payload)
+async def book_payable_invoice_tool(inputs: dict) -> dict:
+    _validate_invoice_data(inputs)  # a few dict/isinstance checks; not worth a thread hop
+    await _ensure_fresh_token()
+
+    inv = (await _post_invoices([await _build_invoice_dict(inputs)]))[0]
+
+    # --- PDF Attachment upload step ---
+    attachment_result = None
+    pdf_bytes = inputs.get("pdf_bytes")
+    if pdf_bytes:
+        attachment_result = await _upload_attachment(inv, pdf_bytes)
+    return _booking_result(inv, attachment_result)
+
+async def book_payable_invoices_bulk(inputs_list: list) -> list:
+    """
+    Book many invoices with one Invoices POST per BULK_INVOICE_LIMIT instead of one each.
+    Returns one dict per input, in order: the same shape as book_payable_invoice_tool, or
+    {"error": ...} for an invoice that failed validation, preparation or Xero's own checks.
+    """
+    await _ensure_fresh_token()
+    results: list = [None] * len(inputs_list)
+
+    async def prepare(i: int, inputs: dict):
         try:
-            resp.raise_for_status()
-        except httpx.HTTPStatusError as e:
-            try:
-                error_body = resp.json()
-            except Exception:
-                error_body = resp.text
-            raise XeroToolError(
-                f"Xero API error {resp.status_code}: {error_body}",
-                xero_response=error_body
-            ) from e
-        inv = resp.json()["Invoices"][0]
-
-        # --- PDF Attachment upload step ---
+            _validate_invoice_data(inputs)
+            return await _build_invoice_dict(inputs)
+        except Exception as e:
+            results[i] = {"error": str(e)}
+
+    # Tax types and account codes are cached per rate/category, so these mostly hit memory
+    built = await asyncio.gather(*(prepare(i, inputs) for i, inputs in enumerate(inputs_list)))
+    ready = [i for i, invoice in enumerate(built) if invoice is not None]
+
+    # summarizeErrors=false: Xero validates each invoice separately instead of failing the batch
+    booked = {}
+
+    async def post_chunk(chunk: list):
+        try:
+            async with _xero_sem:
+                invoices = await _post_invoices([built[i] for i in chunk], BULK_INVOICE_URL)
+        except Exception as e:
+            for i in chunk:
+                results[i] = {"error": str(e)}
+            return
+        for i, inv in zip(chunk, invoices):  # returned in request order
+            if inv.get("HasErrors") or inv.get("ValidationErrors"):
+                messages = [err.get("Message") for err in inv.get("ValidationErrors", [])]
+                results[i] = {"error": f"Xero validation error: {messages}", "xero_response": inv}
+            else:
+                booked[i] = inv
+
+    # Batches beyond BULK_INVOICE_LIMIT post their chunks concurrently over the shared pool
+    await asyncio.gather(*(
+        post_chunk(ready[start:start + BULK_INVOICE_LIMIT])
+        for start in range(0, len(ready), BULK_INVOICE_LIMIT)
+    ))
+
+    async def attach(i: int, inv: dict):
+        pdf_bytes = inputs_list[i].get("pdf_bytes")
         attachment_result = None
-        pdf_bytes_b64 = inputs.get("pdf_bytes")
-        if pdf_bytes_b64:
-            try:
-                pdf_bytes = base64.b64decode(pdf_bytes_b64)
-                invoice_id = inv["InvoiceID"]
-                filename = f"Invoice_{inv['InvoiceNumber']}.pdf"
-                attachment_url = ATTACHMENT_URL_FMT.format(invoice_id=invoice_id, filename=filename)
-
-                await asyncio.sleep(1)  # Xero may be eventually consistent
-
-                # Always use fresh headers and required keys only
-                attach_headers_raw = _get_headers()
-                attach_headers = {
-                    "Authorization":   attach_headers_raw["Authorization"],
-                    "Xero-tenant-id":  attach_headers_raw["Xero-tenant-id"],
-                    "Content-Type":    "application/pdf"
-                }
-
-                print("\n\n=== Xero Attachment Upload Debug ===")
-                print("Xero Attach Headers (without token):", {k: (v[:15]+"...") if k == "Authorization" else v for k,v in attach_headers.items()})
-                print("Xero Attach URL:", attachment_url)
-                print("Xero Attach PDF size:", len(pdf_bytes))
-                print("Reminder: You MUST have 'accounting.attachments' in your Xero app scopes and be authenticated with a token that includes it!\n")
-
-                async with httpx.AsyncClient(timeout=30) as attach_client:
-                    attach_resp = await attach_client.put(
-                        attachment_url,
-                        headers=attach_headers,
-                        content=pdf_bytes
-                    )
-
-                print("Xero Attach Response:", attach_resp.status_code, attach_resp.text)
-                logger.info(f"Attachment PUT response: {attach_resp.status_code}, body: {attach_resp.text}")
-
-                try:
-                    attach_resp.raise_for_status()
-                    attachment_result = {"attachment_status": "uploaded", "file_name": filename}
-                except httpx.HTTPStatusError:
-                    attachment_result = {
-                        "attachment_status": "failed",
-                        "error": attach_resp.text,
-                        "response_status": attach_resp.status_code
-                    }
-            except Exception as ex:
-                attachment_result = {"attachment_status": "failed", "error": str(ex)}
-
-        result = {
-            "xero_invoice_id": inv["InvoiceID"],
-            "status":          inv["Status"],
-            "total":           inv["Total"],
-            "due_date":        inv["DueDate"],
-            "reference":       inv.get("Reference"),
-        }
-        if attachment_result:
-            result.update(attachment_result)
-        return result
+        if pdf_bytes:
+            async with _xero_sem:
+                attachment_result = await _upload_attachment(inv, pdf_bytes)
+        results[i] = _booking_result(inv, attachment_result)
+
+    await asyncio.gather(*(attach(i, inv) for i, inv in booked.items()))
+    return results
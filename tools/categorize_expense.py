@@ -1,7 +1,12 @@
 # tools/categorize_expense.py
 
-import json
-from rapidfuzz import process, fuzz
+import asyncio
+from functools import lru_cache
+from rapidfuzz import process, fuzz, utils
+from .xero_accounts import normalize
+
+# Minimum partial_ratio for a description to map to an account; below it, General Expenses
+MATCH_CUTOFF = 60
 
 def categorize_expense_tool(inputs: dict) -> dict:
     """
@@ -19,29 +24,65 @@ def categorize_expense_tool(inputs: dict) -> dict:
           ...
        ] }
     """
-    allowed_accounts = inputs.get("allowed_accounts", [])
-    items = inputs.get("line_items", [])
+    return {"categories": _categorize_items(
+        inputs.get("line_items", []), inputs.get("allowed_accounts", [])
+    )}
+
+def categorize_expenses_batch(invoices: list) -> list:
+    """
+    Categorize the line items of many invoices (each an inputs dict as above) in one call,
+    so a batch pays for one thread hop instead of one per invoice. Invoices sharing the same
+    allowed_accounts are matched together, and repeated descriptions hit _best_match's cache.
+    Returns one {"categories": [...]} per invoice, in order.
+    """
+    groups = {}  # allowed account codes -> (allowed_accounts, [invoice indexes])
+    for i, inputs in enumerate(invoices):
+        allowed_accounts = inputs.get("allowed_accounts", [])
+        key = tuple(acc["code"] for acc in allowed_accounts)
+        groups.setdefault(key, (allowed_accounts, []))[1].append(i)
+
+    results = [None] * len(invoices)
+    for allowed_accounts, indexes in groups.values():
+        items = [li for i in indexes for li in invoices[i].get("line_items", [])]
+        categories = iter(_categorize_items(items, allowed_accounts))
+        for i in indexes:  # scatter back in input order
+            results[i] = {"categories": [next(categories) for _ in invoices[i].get("line_items", [])]}
+    return results
+
+@lru_cache(maxsize=4096)
+def _best_match(desc: str, allowed_names: tuple):
+    """
+    Fuzzy match description → one of the allowed account names (None if none scores at least
+    MATCH_CUTOFF; the cutoff also lets rapidfuzz skip hopeless candidates early).
+    Both sides come in already run through utils.default_process (case/punctuation folded),
+    so rapidfuzz does no per-candidate preprocessing. Descriptions recur across invoices
+    ("Stationery", "Office chairs"), so scores are memoized per (description, account names).
+    """
+    return process.extractOne(
+        desc, allowed_names, scorer=fuzz.partial_ratio, processor=None, score_cutoff=MATCH_CUTOFF
+    )
+
+def _categorize_items(items: list, allowed_accounts: list) -> list:
+    # Preprocess the names once for matching (a tuple, so it can key _best_match's cache)
+    allowed_names = tuple(utils.default_process(acc["name"]) for acc in allowed_accounts)
+    # fallback to General Expenses
+    fallback = next(
+        (a for a in allowed_accounts if a["name"].lower().startswith("general")),
+        allowed_accounts[0] if allowed_accounts else {"name": "General Expenses", "code": "400"}
+    )
 
-    # Prepare list of just the names for matching
-    allowed_names = [acc["name"] for acc in allowed_accounts]
+    # Descriptions that are just an account name (modulo case/punctuation) skip fuzzy matching
+    exact = {}
+    for acc in allowed_accounts:
+        exact.setdefault(normalize(acc["name"]), acc)
 
     results = []
     for item in items:
         desc = item.get("description", "") or ""
-        # Fuzzy match description → one of the allowed account names
-        match_name, score, idx = process.extractOne(
-            desc,
-            allowed_names,
-            scorer=fuzz.partial_ratio
-        )
-        if score >= 60:
-            account = allowed_accounts[idx]
-        else:
-            # fallback to General Expenses
-            account = next(
-                (a for a in allowed_accounts if a["name"].lower().startswith("general")),
-                allowed_accounts[0] if allowed_accounts else {"name": "General Expenses", "code": "400"}
-            )
+        account = exact.get(normalize(desc))
+        if account is None:
+            match = _best_match(utils.default_process(desc), allowed_names)
+            account = allowed_accounts[match[2]] if match else fallback
 
         results.append({
             "description": desc,
@@ -50,9 +91,8 @@ def categorize_expense_tool(inputs: dict) -> dict:
             "account_code": account["code"]
         })
 
-    return {"categories": results}
+    return results
 
 
 async def categorize_expense_tool_async(inputs: dict) -> dict:
-    import anyio
-    return await anyio.to_thread.run_sync(categorize_expense_tool, inputs)
+    return await asyncio.to_thread(categorize_expense_tool, inputs)
@@ -1,24 +1,47 @@
 # tools/describe_invoice.py
 
-from openai import OpenAI
+from openai_client import async_client, client
 
-client = OpenAI()
+# Line items (largest amounts first) included in the prompt
+MAX_PROMPT_ITEMS = 5
+
+def _amount(item: dict) -> float:
+    try:
+        return float(item.get("amount") or 0)
+    except (TypeError, ValueError):
+        return 0.0
 
 def describe_invoice_tool(inputs: dict) -> dict:
     """
     Generates a short, human-friendly summary of an invoice focused on line item contents.
     Falls back gracefully if no descriptions are provided.
     """
+    response = client.chat.completions.create(**_describe_request(inputs))
+    return {"description": response.choices[0].message.content.strip()}
+
+async def describe_invoice_tool_async(inputs: dict) -> dict:
+    """
+    describe_invoice_tool on the shared AsyncOpenAI client, for async endpoints: no worker
+    thread per call. The SDK retries rate limits and timeouts with backoff (max_retries).
+    """
+    response = await async_client.chat.completions.create(**_describe_request(inputs))
+    return {"description": response.choices[0].message.content.strip()}
+
+def _describe_request(inputs: dict) -> dict:
+    """Chat completion parameters for describe_invoice_tool(_async)."""
     supplier = inputs.get("supplier", "")
     invoice_num = inputs.get("invoice_number", "")
     total = inputs.get("total", "")
     date = inputs.get("date", "")
     items = inputs.get("line_items", [])
 
-    # Check for described line items
+    # Check for described line items; a one-sentence summary only needs the largest few,
+    # with whole amounts (fewer prompt tokens)
+    described = [item for item in items if item.get('description', '').strip()]
+    described.sort(key=lambda item: -_amount(item))
     described_items = [
-        f"- {item.get('quantity', 1)} x {item.get('description', '').strip()} for {item.get('amount', '')}"
-        for item in items if item.get('description', '').strip()
+        f"- {item.get('quantity', 1)} x {item['description'].strip()} for {round(_amount(item))}"
+        for item in described[:MAX_PROMPT_ITEMS]
     ]
 
     if described_items:
@@ -38,12 +61,9 @@ def describe_invoice_tool(inputs: dict) -> dict:
             f"No specific line item descriptions were provided. Guess what this invoice could be about in a natural way."
         )
 
-    response = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[{"role": "user", "content": prompt}],
-        temperature=0.4,
-        max_tokens=60,
-    )
-
-    summary = response.choices[0].message.content.strip()
-    return {"description": summary}
+    return {
+        "model": "gpt-4o-mini",
+        "messages": [{"role": "user", "content": prompt}],
+        "temperature": 0.4,
+        "max_tokens": 40,
+    }
@@ -1,32 +1,205 @@
 # tools/parse_invoice.py
 
+import asyncio
 import base64
-import json
+import hashlib
+import io
+import multiprocessing
+import os
 import re
-import anyio
-from pdf2image import convert_from_bytes
-import pytesseract
-from openai import OpenAI
-from dotenv import load_dotenv
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+import diskcache
+import orjson
+from pdf2image import convert_from_path, pdfinfo_from_path
+from pypdf import PdfReader
+from PIL import Image
+from tesserocr import PyTessBaseAPI, PSM
+from openai_client import client
 
-load_dotenv()
-client = OpenAI()
+# pdftoppm processes used to rasterize pages in parallel
+RASTER_THREADS = min(4, os.cpu_count() or 1)
+# 200 DPI grayscale is plenty for invoice text; raise OCR_DPI if small print gets misread
+OCR_DPI = int(os.getenv("OCR_DPI", "200"))
+# Scans whose OCR yields fewer characters than this are OCR'd once more at OCR_RETRY_DPI
+OCR_RETRY_MIN_CHARS = 50
+OCR_RETRY_DPI = 300
+# OCR worker processes per server process. Each holds a Tesseract model (~100 MB) and every
+# uvicorn worker has its own pool, so this stays small unless OCR_WORKERS says otherwise.
+OCR_WORKERS = int(os.getenv("OCR_WORKERS", str(min(2, os.cpu_count() or 1))))
+# Pages rasterized (and held in memory) at a time on the OCR path; one per OCR worker
+OCR_PAGE_BATCH = OCR_WORKERS
 
+# PDFs whose embedded text layer has at least this many characters skip OCR entirely
+TEXT_LAYER_MIN_CHARS = 200
 
-def parse_invoice_tool(inputs: dict) -> dict:
+PARSE_MODEL = "gpt-4o-mini"
+
+# Structured output: the API enforces this shape, so replies always have every field
+_INVOICE_SCHEMA = {
+    "name": "invoice",
+    "strict": True,
+    "schema": {
+        "type": "object",
+        "properties": {
+            "supplier":       {"type": "string"},
+            "date":           {"type": "string"},
+            "invoice_number": {"type": "string"},
+            "total":          {"type": "number"},
+            "vat_rate":       {"type": "number"},
+            "line_items": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "description": {"type": "string"},
+                        "quantity":    {"type": "number"},
+                        "amount":      {"type": "number"},
+                    },
+                    "required": ["description", "quantity", "amount"],
+                    "additionalProperties": False,
+                },
+            },
+        },
+        "required": ["supplier", "date", "invoice_number", "total", "vat_rate", "line_items"],
+        "additionalProperties": False,
+    },
+}
+
+# Patterns applied to every parsed invoice, compiled once
+# Thousands separators (' and space) dropped and decimal commas made points, in one pass
+_NUM_TRANS = str.maketrans({"'": None, " ": None, ",": "."})
+_NUM_STRIP = re.compile(r"[^\d\.-]")
+# "MWST X% von Y": the taxable base Y
+_MWST_BASE = re.compile(
+    r"(?:MWST|VAT)[^\d\n\r]*(\d{1,3}(?:[.,]\d+)?)\s*%\s*von\s*([0-9'.,\s]+)", re.IGNORECASE
+)
+# "MWST 0% von Z": the discount total Z
+_MWST_DISC = re.compile(r"(?:MWST|VAT)[^\d\n\r]*0(?:[.,]0)?%\s*von\s*([-0-9'.,\s]+)", re.IGNORECASE)
+
+# Extraction completions keyed by a hash of the whole request (model, prompt, parameters), so
+# invoice text that was already extracted never goes to OpenAI again, whichever path (upload or
+# registry call) it arrives by; a prompt change is a new key. temperature=0 makes the answer
+# reusable. Opened on first use, so the spawned OCR workers (which import this module) never do.
+LLM_CACHE_DIR = os.getenv("LLM_CACHE_DIR", "./llm_cache")
+_completion_cache = None
+_completion_cache_lock = threading.Lock()
+
+
+def _get_completion_cache() -> diskcache.Cache:
+    global _completion_cache
+    with _completion_cache_lock:
+        if _completion_cache is None:
+            _completion_cache = diskcache.Cache(LLM_CACHE_DIR, size_limit=2**28)
+        return _completion_cache
+
+
+# Multi-page documents are OCR'd one page per worker process (Tesseract is single-threaded).
+# Created lazily with "spawn" so workers don't inherit the server's threads/connections.
+_ocr_pool = None
+_ocr_pool_lock = threading.Lock()
+_worker_api = None  # per-worker-process Tesseract instance, loaded on first page
+
+
+def _get_ocr_pool() -> ProcessPoolExecutor:
+    global _ocr_pool
+    with _ocr_pool_lock:
+        if _ocr_pool is None:
+            _ocr_pool = ProcessPoolExecutor(
+                max_workers=OCR_WORKERS,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return _ocr_pool
+
+
+def _ocr_page(page) -> str:
+    """Runs inside a pool worker; reuses that worker's Tesseract model across pages."""
+    global _worker_api
+    if _worker_api is None:
+        _worker_api = PyTessBaseAPI(psm=PSM.AUTO)
+    _worker_api.SetImage(page)
+    return _worker_api.GetUTF8Text()
+
+
+def warm_ocr_pool() -> None:
+    """Spawn the OCR workers and load their Tesseract models before the first scanned invoice."""
+    blank = Image.new("L", (32, 32), 255)
+    list(_get_ocr_pool().map(_ocr_page, [blank] * OCR_WORKERS))
+
+
+def _ocr_pages(pages) -> str:
     """
-    OCRs a PDF and extracts invoice fields using GPT.
-    inputs: { "file_bytes": "<base64-encoded PDF>" }
-    Returns:
-      supplier, date, invoice_number, total, vat_rate,
-      taxable_base, discount_total, vat_amount, net_subtotal
+    OCR in-memory PIL pages without spawning a tesseract subprocess (and temp files) per page.
+    Every page, single-page documents included, goes to the process pool, so the number of
+    loaded Tesseract models stays at OCR_WORKERS however many threads are parsing.
+    """
+    return "\n".join(_get_ocr_pool().map(_ocr_page, pages))
+
+
+def _ocr_pdf(source, dpi: int = OCR_DPI) -> str:
+    """
+    Rasterize and OCR a PDF (path or bytes) OCR_PAGE_BATCH pages at a time, so peak memory
+    is one batch of page images rather than the whole document.
+    """
+    if not isinstance(source, str):
+        # pdf2image would re-write the bytes to a temp file for every batch; do it once
+        with tempfile.NamedTemporaryFile(suffix=".pdf") as tmp:
+            tmp.write(source)
+            tmp.flush()
+            return _ocr_pdf(tmp.name, dpi)
+
+    page_count = pdfinfo_from_path(source)["Pages"]
+    texts = []
+    for first in range(1, page_count + 1, OCR_PAGE_BATCH):
+        pages = convert_from_path(
+            source, dpi=dpi, grayscale=True, thread_count=RASTER_THREADS,
+            first_page=first, last_page=min(first + OCR_PAGE_BATCH - 1, page_count)
+        )
+        texts.append(_ocr_pages(pages))
+        for page in pages:
+            page.close()
+    return "\n".join(texts)
+
+
+def _text_layer(source) -> str:
+    """
+    Text embedded in a digitally generated PDF (path or bytes); "" for scans or unreadable files.
     """
-    # 1️⃣ OCR PDF to text
-    raw_bytes = base64.b64decode(inputs["file_bytes"])
-    pages = convert_from_bytes(raw_bytes, dpi=300)
-    ocr_text = "\n".join(pytesseract.image_to_string(p) for p in pages)
+    try:
+        reader = PdfReader(source if isinstance(source, str) else io.BytesIO(source))
+        return "\n".join(page.extract_text() or "" for page in reader.pages)
+    except Exception:
+        return ""
+
+
+def _load_json(raw: str) -> dict:
+    """
+    Parse a structured-output completion. The schema is enforced, so unparseable output
+    (empty, or cut off at the token limit) is an error rather than something to repair.
+    """
+    try:
+        return orjson.loads(raw)
+    except (TypeError, orjson.JSONDecodeError):
+        raise ValueError(f"Invoice extraction returned invalid JSON: {raw!r}")
+
 
-    # 2️⃣ Prompt OpenAI for structured fields
+def _read_text(inputs: dict) -> str:
+    """PDF to text: use the embedded text layer when there is one, OCR otherwise."""
+    source = inputs.get("file_path") or inputs.get("raw_bytes")
+    if source is None:
+        source = base64.b64decode(inputs["file_bytes"])
+    text = _text_layer(source)
+    if len(text.strip()) < TEXT_LAYER_MIN_CHARS:
+        text = _ocr_pdf(source)
+        # Next to nothing recognized: small print may need the higher resolution
+        if len(text.strip()) < OCR_RETRY_MIN_CHARS and OCR_DPI < OCR_RETRY_DPI:
+            text = _ocr_pdf(source, OCR_RETRY_DPI)
+    return text
+
+
+def _extraction_request(ocr_text: str) -> dict:
+    """Chat completion parameters for extracting the invoice fields from its text."""
     prompt = f"""
     You are an accounting assistant. Read the following OCR'd invoice text and extract structured data.
 
@@ -50,49 +223,64 @@ def parse_invoice_tool(inputs: dict) -> dict:
 Invoice Text:
 """ + ocr_text
 
-    resp = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[{"role": "user", "content": prompt}],
-        temperature=0
-    )
-    raw = resp.choices[0].message.content
-
-    def clean(text: str) -> dict:
-        t = text.strip()
-        t = re.sub(r"^```(?:json)?", "", t)
-        t = re.sub(r"```$", "", t)
-        try:
-            return json.loads(t)
-        except json.JSONDecodeError:
-            return {}
-    data = clean(raw)
-
-    def parse_num(val):
-        s = str(val or "").replace("'", "").replace(" ", "").replace(",", ".")
-        s = re.sub(r"[^\d\.-]", "", s)
-        try:
-            return float(s)
-        except ValueError:
-            return 0.0
-
-    total    = parse_num(data.get("total"))
-    vat_rate = parse_num(data.get("vat_rate"))
+    # Structured outputs guarantee a bare JSON object of this shape (no fences, no missing keys)
+    return {
+        "model": PARSE_MODEL,
+        "messages": [{"role": "user", "content": prompt}],
+        "response_format": {"type": "json_schema", "json_schema": _INVOICE_SCHEMA},
+        "temperature": 0
+    }
+
+
+def _request_key(request: dict) -> str:
+    return hashlib.sha256(orjson.dumps(request, option=orjson.OPT_SORT_KEYS)).hexdigest()
+
+
+def parse_invoice_tool(inputs: dict) -> dict:
+    """
+    Reads a PDF's text (OCR only when it has no usable text layer) and extracts invoice fields using GPT.
+    inputs: { "file_bytes": "<base64-encoded PDF>" } or, for in-process callers,
+            { "file_path": "<path to PDF on disk>" } / { "raw_bytes": <PDF bytes> }
+            to skip the base64 round-trip
+    Returns:
+      supplier, date, invoice_number, total, vat_rate,
+      taxable_base, discount_total, vat_amount, net_subtotal
+    """
+    ocr_text = _read_text(inputs)
+    request = _extraction_request(ocr_text)
+    key = _request_key(request)
+    cache = _get_completion_cache()
+    raw = cache.get(key)
+    if raw is not None:
+        return _structure(_load_json(raw), ocr_text)
+    raw = client.chat.completions.create(**request).choices[0].message.content
+    data = _load_json(raw)  # only completions that parse are cached
+    cache.set(key, raw)
+    return _structure(data, ocr_text)
+
+
+def _parse_num(val) -> float:
+    """Lenient number parse for OCR/LLM output ("1'234,50 CHF" -> 1234.5); 0.0 if unparseable."""
+    s = _NUM_STRIP.sub("", str(val or "").translate(_NUM_TRANS))
+    try:
+        return float(s)
+    except ValueError:
+        return 0.0
+
+
+def _structure(data: dict, ocr_text: str) -> dict:
+    """Normalize the extracted fields and derive the VAT figures from the invoice text."""
+
+    total    = _parse_num(data.get("total"))
+    vat_rate = _parse_num(data.get("vat_rate"))
 
     # 5️⃣ Try to extract "MWST X% von Y" taxable base
-    m_base = re.search(
-        r"(?:MWST|VAT)[^\d\n\r]*(\d{1,3}(?:[.,]\d+)?)\s*%\s*von\s*([0-9'.,\s]+)",
-        ocr_text,
-        re.IGNORECASE
-    )
-    taxable_base = round(parse_num(m_base.group(2)), 2) if m_base else 0.0
+    m_base = _MWST_BASE.search(ocr_text)
+    taxable_base = round(_parse_num(m_base.group(2)), 2) if m_base else 0.0
 
     # 6️⃣ Extract any "0% von Z" discount line
-    m_disc = re.search(
-        r"(?:MWST|VAT)[^\d\n\r]*0(?:[.,]0)?%\s*von\s*([-0-9'.,\s]+)",
-        ocr_text,
-        re.IGNORECASE
-    )
-    discount_total = round(parse_num(m_disc.group(1)), 2) if m_disc else 0.0
+    m_disc = _MWST_DISC.search(ocr_text)
+    discount_total = round(_parse_num(m_disc.group(1)), 2) if m_disc else 0.0
 
     # 7️⃣ Compute VAT amount from taxable_base × rate
     if taxable_base and vat_rate:
@@ -128,4 +316,4 @@ async def parse_invoice_tool_async(inputs: dict) -> dict:
     """
     Async wrapper: offloads OCR+parsing to a worker thread.
     """
-    return await anyio.to_thread.run_sync(parse_invoice_tool, inputs)
+    return await asyncio.to_thread(parse_invoice_tool, inputs)
@@ -1,27 +1,69 @@
 import asyncio
-import httpx
+import orjson
 import re
-from rapidfuzz import fuzz
-from .xero_utils import _get_headers, XeroToolError
+import time
+from functools import lru_cache
+from rapidfuzz import fuzz, process, utils
+from .xero_utils import _get_headers, XeroToolError, xero_http
 
 # In-memory cache (per process)
 _category_account_map = {}
 _code_set = set()
+_code_by_norm = {}  # normalize(name) -> code, for O(1) exact matches (first account wins)
+_fuzzy_names = {}  # name -> utils.default_process(name), preprocessed once for _fuzzy_code
+_next_code = 4000  # no free account code below this; reset on reload
+_resolved_codes = {}  # category -> code from ensure_account_for_category_existing_only; reset on reload
+_creating = {}  # normalize(category) -> task running its account-creation POST
+_pending_codes = set()  # codes reserved by in-flight creations; survive reloads in _code_set
 _cache_lock = asyncio.Lock()
+_loaded_at = 0.0  # time.monotonic() of the last full fetch
+
+# Accounts change rarely; re-fetch the chart at most this often (seconds)
+ACCOUNTS_TTL = 300
 
 GENERAL_EXPENSES_CODE = "400"  # Change if your catch-all is different
 
+_NON_WORD = re.compile(r"\W+")
+
+@lru_cache(maxsize=4096)
 def normalize(s: str) -> str:
-    """Lowercase and strip all non-word characters."""
-    return re.sub(r"\W+", "", (s or "")).lower()
+    """Lowercase and strip all non-word characters. Memoized: the same names recur constantly."""
+    return _NON_WORD.sub("", (s or "")).lower()
 
 async def _fetch_accounts() -> list:
     """Fetch all accounts from Xero and cache them."""
     headers = _get_headers()
-    async with httpx.AsyncClient(timeout=15) as client:
-        resp = await client.get("https://api.xero.com/api.xro/2.0/Accounts", headers=headers)
-        resp.raise_for_status()
-        return resp.json().get("Accounts", [])
+    resp = await xero_http.get("https://api.xero.com/api.xro/2.0/Accounts", headers=headers, timeout=15)
+    resp.raise_for_status()
+    return orjson.loads(resp.content).get("Accounts", [])
+
+def _accounts_fresh() -> bool:
+    return bool(_category_account_map) and time.monotonic() - _loaded_at < ACCOUNTS_TTL
+
+async def _ensure_accounts_loaded():
+    """
+    (Re)load the expense accounts when the cache is empty or older than ACCOUNTS_TTL. Hold
+    _cache_lock: concurrent callers on a cold cache then wait for this one fetch instead of
+    each issuing their own.
+    """
+    global _loaded_at, _next_code
+    if _accounts_fresh():
+        return
+    accounts = await _fetch_accounts()
+    _category_account_map.clear()
+    _code_set.clear()
+    _code_by_norm.clear()
+    _fuzzy_names.clear()
+    _resolved_codes.clear()
+    _next_code = 4000
+    _code_set.update(_pending_codes)  # a reload mid-POST must not hand the same code out again
+    for acc in accounts:
+        if acc.get("Type") == "EXPENSE":
+            _category_account_map[acc["Name"]] = acc["Code"]
+            _code_set.add(str(acc["Code"]))
+            _code_by_norm.setdefault(normalize(acc["Name"]), str(acc["Code"]))
+            _fuzzy_names[acc["Name"]] = utils.default_process(acc["Name"])
+    _loaded_at = time.monotonic()
 
 async def ensure_account_for_category_async(category: str) -> str:
     """
@@ -30,103 +72,145 @@ async def ensure_account_for_category_async(category: str) -> str:
     3. If creation fails, fuzzy match to existing account.
     4. Fallback: General Expenses.
     Returns the Xero Account Code as a string.
+    Only the account load and code reservation hold _cache_lock; the (slow) account-creation
+    POST runs outside it, so other lookups don't queue behind it. Concurrent calls for the
+    same new category share a single POST.
     """
+    norm = normalize(category)
+
+    # 1. Try exact name match (normalized); lock-free while the chart is fresh
+    if _accounts_fresh():
+        code = _code_by_norm.get(norm)
+        if code is not None:
+            return code
+
     async with _cache_lock:
-        # Populate cache if empty
-        if not _category_account_map:
-            for acc in await _fetch_accounts():
-                if acc.get("Type") == "EXPENSE":
-                    _category_account_map[acc["Name"]] = acc["Code"]
-                    _code_set.add(str(acc["Code"]))
-
-        norm = normalize(category)
-
-        # 1. Try exact name match (normalized)
-        for name, code in _category_account_map.items():
-            if normalize(name) == norm:
-                return str(code)
-
-        # 2. Try to create a new EXPENSE account with that name
-        code = 4000
-        while str(code) in _code_set or str(code) == GENERAL_EXPENSES_CODE:
-            code += 1
-        payload = {
-            "Accounts": [{
-                "Name": category,
-                "Type": "EXPENSE",
-                "Code": str(code)
-            }]
-        }
-        headers = _get_headers()
-        try:
-            async with httpx.AsyncClient(timeout=15) as client:
-                resp = await client.post(
-                    "https://api.xero.com/api.xro/2.0/Accounts",
-                    headers=headers,
-                    json=payload
-                )
-                resp.raise_for_status()
-                new = resp.json()["Accounts"][0]
-                _category_account_map[new["Name"]] = new["Code"]
-                _code_set.add(str(new["Code"]))
-                return str(new["Code"])
-        except Exception as err:
-            # Xero may return error, e.g., if code or name exists, or API quota/validation
-            pass  # Continue to fallback
-
-        # 3. Fuzzy match: pick best match by similarity (if any)
-        if _category_account_map:
-            best = max(
-                _category_account_map.items(),
-                key=lambda kv: fuzz.token_sort_ratio(category, kv[0])
-            )
-            if fuzz.token_sort_ratio(category, best[0]) > 65:
-                return str(best[1])
-
-        # 4. As last resort, use GENERAL_EXPENSES_CODE
-        return GENERAL_EXPENSES_CODE
+        await _ensure_accounts_loaded()
+        code = _code_by_norm.get(norm)
+        if code is not None:
+            return code
+
+        creating = _creating.get(norm)
+        if creating is None:
+            # Reserve the next free code so concurrent creations don't pick the same one
+            code = _reserve_code()
+            creating = _creating[norm] = asyncio.ensure_future(_create_account(category, norm, code))
+
+    # Shielded: a cancelled caller must not cancel the POST the other callers are awaiting
+    return await asyncio.shield(creating)
+
+async def _create_account(category: str, norm: str, code: int) -> str:
+    """
+    2. Try to create a new EXPENSE account named category with the reserved code.
+    3./4. If creation fails, fuzzy match or GENERAL_EXPENSES_CODE.
+    """
+    try:
+        created = await _post_account(category, code)
+    finally:
+        _creating.pop(norm, None)
+        _pending_codes.discard(str(code))
+    if created is not None:
+        return created
+
+    # 3. Fuzzy match: pick best match by similarity (if any)
+    # 4. As last resort, use GENERAL_EXPENSES_CODE
+    return _fuzzy_code(category)
+
+async def _post_account(category: str, code: int):
+    """POST the account to Xero and add it to the cache. Returns its code, or None on failure."""
+    payload = {
+        "Accounts": [{
+            "Name": category,
+            "Type": "EXPENSE",
+            "Code": str(code)
+        }]
+    }
+    headers = _get_headers()
+    try:
+        resp = await xero_http.post(
+            "https://api.xero.com/api.xro/2.0/Accounts",
+            headers=headers,
+            content=orjson.dumps(payload),
+            timeout=15
+        )
+        resp.raise_for_status()
+        new = orjson.loads(resp.content)["Accounts"][0]
+    except Exception:
+        # Xero may return error, e.g., if code or name exists, or API quota/validation
+        return None  # Continue to fallback
+    # No await from here on, so the maps are updated atomically on the event loop
+    _category_account_map[new["Name"]] = new["Code"]
+    _code_set.add(str(new["Code"]))
+    _code_by_norm.setdefault(normalize(new["Name"]), str(new["Code"]))
+    _fuzzy_names[new["Name"]] = utils.default_process(new["Name"])
+    _resolved_codes.clear()  # earlier fuzzy matches may now prefer the new account
+    return str(new["Code"])
+
+def _reserve_code() -> int:
+    """
+    Next account code from 4000 up that is neither taken nor GENERAL_EXPENSES_CODE, marked as
+    taken. Codes below _next_code are known to be used, so the scan resumes from there.
+    Hold _cache_lock.
+    """
+    global _next_code
+    code = _next_code
+    while str(code) in _code_set or str(code) == GENERAL_EXPENSES_CODE:
+        code += 1
+    _code_set.add(str(code))
+    _pending_codes.add(str(code))
+    _next_code = code + 1
+    return code
 
 async def ensure_account_for_category_existing_only(category: str) -> str:
     """
     Like ensure_account_for_category_async, but ONLY returns an existing code,
     or falls back to GENERAL_EXPENSES_CODE. Never creates new accounts.
     """
+    # Warm path without the lock (nothing awaits between check and read), so lookups don't
+    # queue behind an account fetch or an account-creation POST
+    code = _resolved_codes.get(category)
+    if code is not None and _accounts_fresh():
+        return code
     async with _cache_lock:
-        if not _category_account_map:
-            for acc in await _fetch_accounts():
-                if acc.get("Type") == "EXPENSE":
-                    _category_account_map[acc["Name"]] = acc["Code"]
-                    _code_set.add(str(acc["Code"]))
-
-        norm = normalize(category)
-        for name, code in _category_account_map.items():
-            if normalize(name) == norm:
-                return str(code)
-
-        # Fuzzy fallback
-        if _category_account_map:
-            best = max(
-                _category_account_map.items(),
-                key=lambda kv: fuzz.token_sort_ratio(category, kv[0])
-            )
-            if fuzz.token_sort_ratio(category, best[0]) > 65:
-                return str(best[1])
-
-        return GENERAL_EXPENSES_CODE
+        await _ensure_accounts_loaded()
+        code = _resolved_codes.get(category)
+        if code is None:
+            # Fuzzy scan over every account (on an exact-name miss) only once per category per account load
+            code = _resolved_codes[category] = _match_existing(category)
+        return code
+
+def _match_existing(category: str) -> str:
+    code = _code_by_norm.get(normalize(category))
+    if code is not None:
+        return code
+
+    # Fuzzy fallback
+    return _fuzzy_code(category)
+
+def _fuzzy_code(category: str) -> str:
+    """
+    Code of the account whose name best matches category (token_sort_ratio above 65), else
+    GENERAL_EXPENSES_CODE. Names are compared case/punctuation-insensitively: the account
+    names were preprocessed when loaded, so only category is processed here. The cutoff lets
+    extractOne skip accounts that can't reach the threshold.
+    """
+    best = process.extractOne(
+        utils.default_process(category), _fuzzy_names,
+        scorer=fuzz.token_sort_ratio, processor=None, score_cutoff=65
+    )
+    if best and best[1] > 65:
+        return str(_category_account_map[best[2]])  # mapping choices: best[2] is the name
+    return GENERAL_EXPENSES_CODE
 
 async def get_all_expense_accounts() -> list:
     """
     Returns a list of dicts with all expense accounts from Xero.
     Each dict has at least 'name' and 'code'.
     """
-    async with _cache_lock:
-        # Refresh the cache if empty
-        if not _category_account_map:
-            for acc in await _fetch_accounts():
-                if acc.get("Type") == "EXPENSE":
-                    _category_account_map[acc["Name"]] = acc["Code"]
-                    _code_set.add(str(acc["Code"]))
-        return [
-            {"name": name, "code": code}
-            for name, code in _category_account_map.items()
-        ]
+    if not _accounts_fresh():
+        async with _cache_lock:
+            await _ensure_accounts_loaded()
+    return [
+        {"name": name, "code": code}
+        for name, code in _category_account_map.items()
+    ]
@@ -1,8 +1,13 @@
 # tools/xero_utils.py
 
+import asyncio
 import os
-import json
+import orjson
+import tempfile
 import logging
+import threading
+import time
+import httpx
 
 # These files should match what your OAuth logic writes!
 TOKEN_FILE  = "/app/xero_token.json"
@@ -11,38 +16,193 @@ TENANT_FILE = "/app/xero_tenant_id.txt"
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Xero answers with these when throttling (429) or briefly overloaded; worth a short retry.
+# A 429 means the request was rejected before it ran, so any method may be resent; a 5xx
+# may come after a POST/PUT already created the invoice, so only safe methods retry those.
+RETRY_STATUSES = {429, 502, 503, 504}
+SAFE_RETRY_STATUSES = {429}
+IDEMPOTENT_METHODS = {"GET", "HEAD"}
+XERO_RETRIES = 3
+RETRY_BACKOFF = 0.3       # seconds, doubled per attempt when there is no Retry-After
+RETRY_AFTER_MAX = 10.0    # longer waits (e.g. the daily limit) are returned to the caller
+
+class _RetryTransport(httpx.AsyncBaseTransport):
+    """
+    Retries throttled (429) requests on xero_http, and 502/503/504 for GET/HEAD only,
+    honouring Retry-After, so Xero's minute-limit throttling shows up as a short delay
+    instead of a failed booking without ever double-posting an invoice.
+    """
+    def __init__(self, transport: httpx.AsyncBaseTransport):
+        self._transport = transport
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        retry_on = RETRY_STATUSES if request.method in IDEMPOTENT_METHODS else SAFE_RETRY_STATUSES
+        for attempt in range(XERO_RETRIES + 1):
+            response = await self._transport.handle_async_request(request)
+            if response.status_code not in retry_on or attempt == XERO_RETRIES:
+                return response
+            try:
+                delay = float(response.headers.get("Retry-After", ""))
+            except ValueError:
+                delay = RETRY_BACKOFF * 2 ** attempt
+            if delay > RETRY_AFTER_MAX:
+                return response
+            await response.aclose()
+            logger.info("Xero returned %s for %s; retrying in %.1fs", response.status_code, request.url.path, delay)
+            await asyncio.sleep(delay)
+
+    async def aclose(self):
+        await self._transport.aclose()
+
+# Shared connection pool to api.xero.com: keep-alive means one TLS handshake per connection
+# instead of one per tool call. The static JSON headers live on the client; requests only
+# add auth/tenant (and override Content-Type where needed). Connection failures are retried
+# by the inner transport, throttling by _RetryTransport.
+xero_http = httpx.AsyncClient(
+    transport=_RetryTransport(httpx.AsyncHTTPTransport(
+        http2=True,
+        limits=httpx.Limits(max_keepalive_connections=10),
+        retries=2,
+    )),
+    headers={"Content-Type": "application/json", "Accept": "application/json"},
+    timeout=httpx.Timeout(30.0, connect=5.0),
+)
+
 class XeroToolError(Exception):
     def __init__(self, message, xero_response=None):
         self.xero_response = xero_response
         super().__init__(message)
 
+def _write_atomic(path: str, data):
+    """
+    Readers never see a half-written file: write a sibling temp file, then rename over.
+    The temp name is unique, so concurrent writers (e.g. two workers refreshing) never share
+    one. No fsync unless XERO_FSYNC_TOKENS is set; a lost token only means re-authenticating.
+    """
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path) or ".", prefix=os.path.basename(path) + ".")
+    try:
+        with os.fdopen(fd, "wb" if isinstance(data, bytes) else "w") as f:
+            f.write(data)
+            if os.getenv("XERO_FSYNC_TOKENS"):
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
 def _load_tokens() -> dict:
     """
     Loads the current Xero OAuth tokens from disk.
     Raises XeroToolError if not found or corrupted.
     """
     try:
-        with open(TOKEN_FILE, "r") as f:
-            return json.load(f)
+        with open(TOKEN_FILE, "rb") as f:
+            return orjson.loads(f.read())
     except FileNotFoundError:
         raise XeroToolError("Authentication required - no token found")
-    except json.JSONDecodeError:
+    except orjson.JSONDecodeError:
         raise XeroToolError("Corrupted token file - please reauthenticate")
 
+# Parsed tokens + headers, reused until the token file changes on disk (keyed by its mtime)
+# or invalidate_headers() is called after a token refresh. The mtime is checked at most every
+# TOKEN_STAT_INTERVAL seconds, so most Xero calls skip the stat and the lock; writes in this
+# process invalidate at once, other workers' refreshes are picked up within the interval.
+TOKEN_STAT_INTERVAL = 5.0
+_cached_credentials: tuple | None = None  # (headers, tokens), replaced as one
+_cached_mtime: int | None = None
+_stat_checked_at = 0.0  # time.monotonic() of the last TOKEN_FILE stat
+_token_expires_at: float | None = None  # epoch seconds; None when the token has no expires_in
+_headers_lock = threading.Lock()
+
+# The tenant only changes on re-auth, which rewrites the token file too (tenant first), so it
+# is read once and only re-read when the tokens are.
+_tenant_id_cache: str | None = None
+
+def reset_tenant_cache():
+    """Forget the cached tenant id so the next lookup re-reads TENANT_FILE."""
+    global _tenant_id_cache
+    _tenant_id_cache = None
+
+def _tenant_id() -> str:
+    global _tenant_id_cache
+    if _tenant_id_cache is None:
+        try:
+            with open(TENANT_FILE, "r") as f:
+                _tenant_id_cache = f.read().strip()
+        except FileNotFoundError:
+            raise XeroToolError("Authentication required - no tenant id found")
+    return _tenant_id_cache
+
+def save_credentials(tokens: dict, tenant_id: str):
+    """
+    Store the tokens and tenant from a completed OAuth flow. The tenant goes first: the
+    tools only re-read it when the token file changes. Blocking file IO; call it off the loop.
+    """
+    _write_atomic(TENANT_FILE, tenant_id)
+    reset_tenant_cache()
+    save_tokens(tokens)
+
+def save_tokens(tokens: dict):
+    """
+    Write tokens (from the OAuth flow or a refresh) to TOKEN_FILE, stamped with expires_at, and
+    drop the cached headers. Blocking file IO; call it off the loop.
+    """
+    if tokens.get("expires_in"):
+        tokens["expires_at"] = time.time() + tokens["expires_in"]  # lets the tools refresh ahead of a 401
+    _write_atomic(TOKEN_FILE, orjson.dumps(tokens))
+    invalidate_headers()
+
+def invalidate_headers():
+    """Forget the cached headers so the next _get_headers() re-reads both files."""
+    global _cached_credentials
+    with _headers_lock:
+        _cached_credentials = None
+
 def _get_headers() -> dict:
     """
-    Returns a dict of HTTP headers for authenticating to Xero.
-    """
-    tokens = _load_tokens()
-    with open(TENANT_FILE, "r") as f:
-        tenant_id = f.read().strip()
-    return {
-        "Authorization":   f"Bearer {tokens['access_token']}",
-        "Xero-tenant-id":  tenant_id,
-        "Content-Type":    "application/json",
-        "Accept":          "application/json"
-    }
-
-# If you want, you can future-proof with:
-# async def _get_headers_async() -> dict:
-#     return _get_headers()
+    Returns the per-tenant HTTP headers (Authorization, Xero-tenant-id) for Xero; the JSON
+    Content-Type/Accept defaults are set on xero_http.
+    The dict is shared between calls; copy it before modifying.
+    """
+    return _get_credentials()[0]
+
+def _get_tokens() -> dict:
+    """The parsed token file behind the current headers (e.g. for a refresh), without re-reading it."""
+    return _get_credentials()[1]
+
+def token_expiring(margin: float = 60) -> bool:
+    """
+    True when the cached access token expires within `margin` seconds, so callers can refresh
+    up front instead of spending a round-trip on a 401. Tokens without expires_in never are.
+    """
+    _get_credentials()
+    return _token_expires_at is not None and time.time() > _token_expires_at - margin
+
+def _get_credentials() -> tuple:
+    global _cached_credentials, _cached_mtime, _stat_checked_at, _token_expires_at
+    cached = _cached_credentials
+    if cached is not None and time.monotonic() - _stat_checked_at < TOKEN_STAT_INTERVAL:
+        return cached
+    try:
+        mtime = os.stat(TOKEN_FILE).st_mtime_ns
+    except FileNotFoundError:
+        raise XeroToolError("Authentication required - no token found")
+    with _headers_lock:
+        if _cached_credentials is None or _cached_mtime != mtime:
+            tokens = _load_tokens()
+            if _cached_mtime != mtime:
+                reset_tenant_cache()  # new token file: possibly a re-auth to another tenant
+            headers = {
+                "Authorization":   f"Bearer {tokens['access_token']}",
+                "Xero-tenant-id":  _tenant_id(),
+            }
+            _cached_mtime = mtime
+            # Writers stamp expires_at; for older files, the mtime is (about) when Xero issued the token
+            expires_in = tokens.get("expires_in")
+            _token_expires_at = tokens.get("expires_at") or (
+                mtime / 1e9 + expires_in if expires_in else None
+            )
+            _cached_credentials = (headers, tokens)
+        _stat_checked_at = time.monotonic()
+        return _cached_credentials
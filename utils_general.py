@@ -1,28 +1,27 @@
 # utils_general.py
 
-import json
-import re
+import orjson
 
 def extract_json_from_text(text):
     """
     Extracts and parses JSON from a GPT response, even if it's wrapped in markdown.
+    Prefer response_format={"type": "json_object"} so this is never needed.
     """
     text = text.strip()
 
     # Remove common markdown formatting
-    text = re.sub(r"^```(?:json)?", "", text)
-    text = re.sub(r"```$", "", text)
+    text = text.removeprefix("```json").removeprefix("```").removesuffix("```").strip()
 
     # Try parsing JSON directly
     try:
-        return json.loads(text)
-    except json.JSONDecodeError:
-        # Attempt to extract JSON using regex
-        match = re.search(r"\{.*\}", text, re.DOTALL)
-        if match:
+        return orjson.loads(text)
+    except orjson.JSONDecodeError:
+        # Fall back to the outermost {...} span (linear scan, no backtracking regex)
+        start, end = text.find("{"), text.rfind("}")
+        if start != -1 and end > start:
             try:
-                return json.loads(match.group())
-            except json.JSONDecodeError:
+                return orjson.loads(text[start:end + 1])
+            except orjson.JSONDecodeError:
                 return {
                     "error": "Failed to parse extracted JSON",
                     "raw_response": text